@@ -1,6 +1,8 @@
 import argparse
+import collections
 import os.path
 import struct
+import sys
 import inspect
 from dataclasses import dataclass # ImportError? Upgrade to Python 3.7 or pip install dataclasses
 
@@ -443,7 +445,6 @@ def parse_savefile(fn):
 	print(savefile.bank_block_len, savefile.unknown12, savefile.bank_capacity)
 	print(savefile.bank_weapons)
 	assert len(data) == 0
-	assert encode_dataclass(savefile, Savefile) == data.data
 	if args.synth is not None:
 		savefile.name = "PATCHED"
 		for synth, synthargs in args.synth: synth(savefile, *synthargs)
@@ -451,17 +452,104 @@ def parse_savefile(fn):
 		with open(os.path.basename(fn), "wb") as f: f.write(synthesized)
 	return ""
 
+def verify_savefile(fn):
+	"""Check that a save file decodes and re-encodes to exactly what it was
+
+	This is what --verify does instead of listing, so normal runs don't pay for it.
+	"""
+	with open(fn, "rb") as f: data = Consumable(f.read())
+	savefile = decode_dataclass(data, Savefile)
+	if len(data): raise SaveFileFormatError("%d bytes left over after decoding" % len(data))
+	reconstructed = encode_dataclass(savefile, Savefile)
+	if reconstructed != data.data:
+		ofs = next((i for i, (a, b) in enumerate(zip(data.data, reconstructed)) if a != b), min(len(data.data), len(reconstructed)))
+		raise SaveFileFormatError("Imperfect reconstruction: lengths %d/%d, first difference at %d" % (len(data.data), len(reconstructed), ofs))
+	return "OK (%d bytes)" % len(reconstructed)
+
+def inventory(fn):
+	"""Get a save file's weapons and items (that pass the loot filters) for diff_inventories"""
+	with open(fn, "rb") as f: savefile = decode_dataclass(Consumable(f.read()), Savefile)
+	ret = []
+	for thing in savefile.weapons + savefile.dlc_weapons + savefile.items + savefile.dlc_items:
+		if any(not filter(thing, *filterargs) for filter, filterargs in args.loot_filter or ()): continue
+		# There's no unique ID, so anything with all the same parts counts as the same thing
+		key = (type(thing).__name__, thing.grade, thing.type, thing.mfg, tuple(thing.pieces), thing.prefix, thing.title)
+		ret.append((key, thing.level, "%d: [%d-%d] %s %s" % (thing.slot, thing.level, thing.quality,
+			thing.prefix.split(".")[-1], thing.title.split(".")[-1])))
+	return ret
+
+def diff_inventories(old, new):
+	"""Compare two inventories, each a list of (key, level, description)
+
+	Things are matched up by key, which is whatever identifies one, other than
+	its level. Yields ("+", description) for anything new, ("-", description)
+	for anything gone, and ("^", description) for anything whose level changed.
+	"""
+	olds, news = collections.defaultdict(list), collections.defaultdict(list)
+	for key, lvl, desc in old: olds[key].append((lvl, desc))
+	for key, lvl, desc in new: news[key].append((lvl, desc))
+	for key in dict.fromkeys(list(olds) + list(news)): # Deduplicate but keep order
+		# Anything at the same level on both sides hasn't changed
+		same = collections.Counter(lvl for lvl, desc in olds[key]) & collections.Counter(lvl for lvl, desc in news[key])
+		gone, added = [], []
+		for things, changed in ((olds[key], gone), (news[key], added)):
+			unmatched = same.copy()
+			for lvl, desc in sorted(things, key=lambda t: t[0]):
+				if unmatched[lvl]: unmatched[lvl] -= 1
+				else: changed.append((lvl, desc))
+		for (oldlvl, _), (lvl, desc) in zip(gone, added): yield "^", "%s (was level %d)" % (desc, oldlvl)
+		for lvl, desc in gone[len(added):]: yield "-", desc
+		for lvl, desc in added[len(gone):]: yield "+", desc
+
+def watch_directory(dir, changed):
+	"""Call changed(path) every time a save file in dir has been written, until Ctrl-C"""
+	import pyinotify # ImportError? pip install pyinotify
+	class Handler(pyinotify.ProcessEvent):
+		def process_default(self, event):
+			if event.name.endswith(".sav"): changed(event.pathname)
+	wm = pyinotify.WatchManager()
+	# Saves might be written in place, or written elsewhere and moved in
+	wm.add_watch(dir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+	try: pyinotify.Notifier(wm, Handler()).loop()
+	except KeyboardInterrupt: pass
+
+def watch(dir, inventory):
+	"""Keep watching dir, and report what changes in each save's inventory"""
+	known = { }
+	for fn in sorted(os.listdir(dir)):
+		if not fn.endswith(".sav"): continue
+		try: known[fn] = inventory(os.path.join(dir, fn))
+		except Exception as e: print(fn, "...", e) # Keep going - it might get fixed by the next save
+	print("Watching %d save files in %s" % (len(known), dir))
+	def changed(path):
+		fn = os.path.basename(path)
+		try: new = inventory(path)
+		except Exception as e:
+			print(fn, "...", e)
+			return
+		changes = list(diff_inventories(known.get(fn, []), new))
+		known[fn] = new
+		print("%s... %d change%s" % (fn, len(changes), "s" * (len(changes) != 1)))
+		for sign, desc in changes: print(sign, desc)
+	watch_directory(dir, changed)
+
 def main(args):
 	# TODO: Support the non-GOTY version too?
 	# TODO: Locate paths case insensitively in case there's differences
 	# GOTY non-enhanced: /steam/steamapps/compatdata/8980/pfx/drive_c/users/steamuser/My Documents/my games/borderlands/savedata
 	dir = os.path.expanduser(args.path + "/steam/steamapps/compatdata/729040/pfx/drive_c/users/steamuser/My Documents/My Games/Borderlands Game of the Year/Binaries/SaveData")
+	if args.watch: return watch(dir, inventory)
+	failures = 0
 	for fn in sorted(os.listdir(dir)):
 		if not fn.endswith(".sav"): continue
 		print(fn, end="... ")
-		try: print(parse_savefile(os.path.join(dir, fn)))
-		except SaveFileFormatError as e: print(e.args[0])
+		try: print((verify_savefile if args.verify else parse_savefile)(os.path.join(dir, fn)))
+		except SaveFileFormatError as e:
+			print(e.args[0])
+			failures += 1
 		print()
+	# Nonzero exit if anything didn't round-trip, for the benefit of scripts
+	if args.verify and failures: sys.exit(1)
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Borderlands 1 save file reader")
@@ -470,6 +558,8 @@ if __name__ == '__main__':
 	# parser.add_argument("--raw", help="Show the raw details of weapons/items (spammy - use loot filters)", action="store_true")
 	parser.add_argument("--synth", help="Synthesize a modified save file", type=synthesizer, nargs="*")
 	parser.add_argument("-l", "--loot-filter", help="Show loot, optionally filtered to only what's interesting", type=loot_filter, nargs="*")
+	parser.add_argument("--verify", help="Verify that saves re-encode exactly, instead of listing them (exits 1 on any failure)", action="store_true")
+	parser.add_argument("--watch", help="Keep watching for saves (needs pyinotify), and show what changed in their inventories", action="store_true")
 	# parser.add_argument("-f", "--file", help="Process only one save file")
 	args = parser.parse_args()
 	print(args)
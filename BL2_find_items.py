@@ -7,47 +7,130 @@
 # not save files from consoles (they may be big-endian, and/or use another
 # compression algorithm). Currently the path is hard-coded for Linux though.
 import argparse
+import atexit
 import base64
 import binascii
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
 import hashlib
+import heapq
+import io
 import itertools
 import json
 import math
+import multiprocessing
 import os.path
+import pickle
+import socket
+import socketserver
+import sqlite3
 import struct
 import sys
 import random
+import tempfile
+import resource
+import time
+import traceback
+import tracemalloc
+import types
 from fnmatch import fnmatch
+import dataclasses
 from dataclasses import dataclass # ImportError? Upgrade to Python 3.7 or pip install dataclasses
 from pprint import pprint
 import lzo # ImportError? pip install python-lzo
-from BL1_find_items import FunctionArg, Consumable
+from BL1_find_items import FunctionArg, Consumable, watch
 
 # python-lzo 1.12 on Python 3.8 causes a DeprecationWarning regarding arg parsing with integers.
 import warnings; warnings.filterwarnings("ignore")
 
 loot_filter = FunctionArg("filter", 2)
 
+def needs(*fields):
+	"""Declare which Asset fields a loot filter looks at
+
+	Items get decoded only as far as the filters need, and only those that
+	pass get decoded in full. A filter that doesn't say, needs everything.
+	"""
+	def deco(func):
+		func.needs = fields
+		return func
+	return deco
+
 @loot_filter
+@needs("grade")
 def level(usage, item, minlvl, maxlvl=None):
 	minlvl = int(minlvl)
 	if maxlvl is None: maxlvl = minlvl + 5
 	return minlvl <= item.grade <= int(maxlvl)
 
 @loot_filter
+@needs("type")
 def type(usage, item, type): return type in item.type
 del type # I want the filter to be called type, but not to override type()
 
 @loot_filter
+@needs("title")
 def title(usage, item, tit): return item.title is not None and tit in item.title
 
 @loot_filter
+@needs()
 def loose(usage, item): return not usage.is_equipped() and usage.is_carried()
+del level, title # The queries (below) have some of the same names, and these are only needed via loot_filter
+
+# Like loot filters, but for --query, and each one returns an SQL condition
+# (and its parameters) against the inventory index's items table.
+query = FunctionArg("query")
+
+@query
+def level(minlvl, maxlvl=None):
+	if maxlvl is None: return "grade >= ?", [int(minlvl)] # level:70 means 70+
+	return "grade between ? and ?", [int(minlvl), int(maxlvl)]
+
+@query
+def type(type): return "type like ?", ["%" + type + "%"]
+del type # As above, don't override type()
+
+@query
+def title(tit): return "title like ?", ["%" + tit + "%"]
+
+@query
+def brand(brand): return "brand like ?", ["%" + brand + "%"]
+
+@query
+def balance(bal): return "balance like ?", ["%" + bal + "%"]
+
+@query
+def part(part): return "pieces like ?", ["%" + part + "%"]
+
+@query
+def bank(): return "location = 'bank'", []
+
+@query
+def carried(): return "location != 'bank'", []
+
+@query
+def equipped(): return "location = 'equipped'", []
+
+@query
+def weapons(): return "is_weapon", []
+
+@query
+def items(): return "not is_weapon", []
+
+@query
+def char(name): return "character like ?", ["%" + name + "%"]
+
+@query
+def game(game): return "game = ?", [{"bl2": "borderlands 2", "tps": "borderlands the pre-sequel"}.get(game.lower(), game)]
+# They're only wanted as --query keywords, not as globals getting in the way of variables
+del level, title, brand, balance, part, bank, carried, equipped, weapons, items, char, game
 
 synthesizer = FunctionArg("synth", 1)
 
-def strip_prefix(str): return str.split(".", 1)[1]
+def strip_prefix(str): return sys.intern(str.split(".", 1)[1])
 def armor_serial(serial): return base64.b64encode(serial).decode("ascii").strip("=")
 def unarmor_serial(id): return base64.b64decode(id.strip("{}").encode("ascii") + b"====")
 def partnames(is_weapon):
@@ -75,36 +158,46 @@ def xp(savefile, xp=None):
 @synthesizer
 def boost(savefile):
 	"""Boost the levels of all equipped gear lower than your current level"""
-	for i, weapon in enumerate(savefile.packed_weapon_data):
-		weap = Asset.decode_asset_library(weapon.serial)
-		if weap.grade < savefile.level and weapon.quickslot:
-			weap.grade = weap.stage = savefile.level
-			savefile.packed_weapon_data[i].serial = weap.encode_asset_library()
-	for i, item in enumerate(savefile.packed_item_data):
-		it = Asset.decode_asset_library(item.serial)
-		if it and it.grade < savefile.level and item.equipped:
-			it.grade = it.stage = savefile.level
-			savefile.packed_item_data[i].serial = it.encode_asset_library()
+	boosted = []
+	for packed in savefile.packed_weapon_data, savefile.packed_item_data:
+		for slot, obj in zip(packed, Asset.decode_asset_libraries([slot.serial for slot in packed])):
+			if obj and obj.grade < savefile.level and slot.is_equipped():
+				obj.grade = obj.stage = savefile.level
+				boosted.append((slot, obj))
+	for (slot, obj), serial in zip(boosted, Asset.encode_asset_libraries([obj for slot, obj in boosted])):
+		slot.serial = serial
+
+@synthesizer
+def pad(savefile, size):
+	"""Pad out the bank with copies of what's already there, to make a save of (at least) the given size
+
+	This makes an oversized save (eg pad:1000000) to test chunked compression
+	with. Probably not something you want to load in-game.
+	"""
+	size = int(size)
+	carried = (savefile.packed_weapon_data or []) + (savefile.packed_item_data or [])
+	serials = [slot.serial for slot in (savefile.bank or []) + carried]
+	if not serials: raise ValueError("Nothing to pad with")
+	if savefile.bank is None: savefile.bank = []
+	# Each bank slot costs its serial plus a few bytes of protobuf framing.
+	need = size - len(savefile.encode_protobuf())
+	for serial in itertools.cycle(serials):
+		if need <= 0: break
+		savefile.bank.append(BankSlot(serial=serial))
+		need -= len(serial) + 4
 
 @synthesizer
 def invdup(savefile, level):
 	"""Duplicate inventory at a new level for comparison"""
 	levels = [int(l) for l in level.split(",") if l]
 	if not levels: raise ValueError("C'mon, get on my level, man")
-	for weapon in savefile.packed_weapon_data:
-		weap = Asset.decode_asset_library(weapon.serial)
-		if weap.grade not in levels and not weapon.quickslot:
-			for level in levels:
-				weap.grade = weap.stage = level
-				weap.seed = random.randrange(1<<31)
-				savefile.add_inventory(weap)
-	for item in savefile.packed_item_data:
-		it = Asset.decode_asset_library(item.serial)
-		if it and it.grade not in levels and not item.equipped:
-			for level in levels:
-				it.grade = it.stage = level
-				it.seed = random.randrange(1<<31)
-				savefile.add_inventory(it)
+	dups = []
+	for packed in savefile.packed_weapon_data, savefile.packed_item_data:
+		for slot, obj in zip(packed, Asset.decode_asset_libraries([slot.serial for slot in packed])):
+			if obj and obj.grade not in levels and not slot.is_equipped():
+				for level in levels:
+					dups.append(dataclasses.replace(obj, grade=level, stage=level, seed=random.randrange(1<<31)))
+	savefile.add_inventory(*dups)
 
 def get_part_list(cls, lst):
 	if isinstance(lst, str):
@@ -175,31 +268,52 @@ def give(savefile, definitions):
 		savefile.add_inventory(obj)
 		print("Giving", obj)
 
-def get_piece_options(obj):
-	# TODO: Make use of get_balance_info rather than duplicating the work
-	cls = "Weapon" if obj.is_weapon else "Item"
-	config = get_asset_library_manager()
-	setid, sublib, asset, cat = config["_find_asset"]["BalanceDefs"][obj.balance]
-	allbal = get_asset(cls + " Balance")
+@functools.lru_cache(maxsize=256)
+def get_balance_pieces(is_weapon, balance):
+	"""Find the available parts for each piece of anything of this balance
+
+	Returns a tuple with a tuple of options per piece, or None if unknown.
+	"""
+	cls = "Weapon" if is_weapon else "Item"
+	names = partnames(is_weapon)
 	# Build up a full list of available parts
-	# Assumes that the "mode" is always "Selective" as I don't know how "Additive" works exactly
-	checkme = cat + "." + obj.balance
-	pieces = [None] * len(obj.partnames)
-	while checkme:
-		print(checkme)
-		if "type" in allbal[checkme] and "parts" not in allbal[checkme]:
-			# FIXME: When working with turtle shields, need to look up the type, but they
-			# also have some parts in the balance. Maybe always look up both and merge??
-			# Some items don't have their parts in their balance definition, but they have
-			# a type definition that has them instead.
-			typeinfo = get_asset(cls + " Types")[allbal[checkme]["item"]]
-			pieces = [p or get_part_list(cls, typeinfo.get(part + "_parts")) for p, part in zip(pieces, obj.partnames)]
-			# Is it possible to have a base but no parts?
-			break
-		
-		pieces = [p or parts.get(part) for p, part in zip(pieces, obj.partnames)]
-		checkme = allbal[checkme].get("base")
-	return [p1 or [p2] for p1, p2 in zip(pieces, obj.pieces)] # Any still unfound, just leave the current piece (or None) in them
+	info = get_balance_info(is_weapon, balance)
+	pieces = [info.get("parts", {}).get(part) for part in names]
+	if "item" in info and not all(pieces):
+		# FIXME: When working with turtle shields, need to look up the type, but they
+		# also have some parts in the balance. Maybe always look up both and merge??
+		# Some items don't have their parts in their balance definition, but they have
+		# a type definition that has them instead.
+		typeinfo = get_asset(cls + " Types").get(info["item"], { })
+		pieces = [p or get_part_list(cls, typeinfo.get(part + "_parts")) for p, part in zip(pieces, names)]
+	return tuple(tuple(p) if p else None for p in pieces)
+
+def get_piece_options(obj):
+	# Any unknown, just leave the current piece (or None) in them. The
+	# caller gets to mutate these lists, so they mustn't be the shared ones.
+	return [list(p1) if p1 else [p2] for p1, p2 in zip(get_balance_pieces(obj.is_weapon, obj.balance), obj.pieces)]
+
+CROSSPRODUCT_LIMIT = 1000 # Never give more than this many from one crossproduct, unless told to (limit=N)
+CROSSPRODUCT_BATCH = 256 # Objects are packed/encrypted this many at a time
+
+def sample_product(pieces, count):
+	"""Pick count distinct combinations, uniformly at random, from itertools.product(*pieces)
+
+	They come out in the same order product() would give them. The product
+	itself never gets built, so this is fine even for enormous ones.
+	"""
+	total = math.prod(len(opts) for opts in pieces)
+	if count >= total:
+		yield from itertools.product(*pieces)
+		return
+	picks = set()
+	while len(picks) < count: picks.add(random.randrange(total))
+	for idx in sorted(picks):
+		combo = []
+		for opts in reversed(pieces):
+			idx, i = divmod(idx, len(opts))
+			combo.append(opts[i])
+		yield combo[::-1]
 
 @synthesizer
 def crossproduct(savefile, baseid):
@@ -210,11 +324,19 @@ def crossproduct(savefile, baseid):
 	print("Basis:", obj)
 	pieces = get_piece_options(obj)
 	interactive = False
+	limit, sample = CROSSPRODUCT_LIMIT, None
+	seen = set() # Serials (sans seed and CRC) already given, so nothing is given twice
 	while "interactive or at least once":
 		for fixed in lockdown:
 			if fixed == "input":
 				interactive = True
 				continue
+			if fixed.startswith("limit=") or fixed.startswith("sample="):
+				# "limit=N" to change the cap; "sample=N" to pick N at random from the whole lot
+				kwd, n = fixed.split("=")
+				if kwd == "limit": limit = int(n)
+				else: sample = int(n) or None
+				continue
 			if fixed.startswith("-") and fixed[1:] in obj.partnames:
 				# Specify "-delta" to have nothing in slot delta
 				pieces[obj.partnames.index(fixed[1:])] = [None]
@@ -242,16 +364,33 @@ def crossproduct(savefile, baseid):
 			if not obj.pieces[i] and None not in opts:
 				print(n, "\x1b[1mNone\x1b[0m")
 			total *= len(opts)
-		print("Will create", total, "objects.")
+		if sample and min(sample, limit) < total: print("Will create", min(sample, limit), "objects, sampled from", total)
+		elif total > limit: print("Will create", limit, "of", total, "objects (use limit=N to change the cap, or sample=N)")
+		else: print("Will create", total, "objects.")
 		lockdown = []
 		fixme = interactive and input()
 		if fixme == "give" or fixme == "gr" or not fixme:
-			for pp in itertools.product(*pieces):
-				obj.seed = random.randrange(1<<31)
-				obj.grade = obj.stage = savefile.level
-				obj.pieces = [piece and strip_prefix(piece) for piece in pp]
-				if total < 10: print(">", obj)
-				savefile.add_inventory(obj)
+			obj.grade = obj.stage = savefile.level
+			# Cap the sample before choosing it, not after (which would only keep the start of the product)
+			combos = sample_product(pieces, min(sample, limit)) if sample else itertools.product(*pieces)
+			objs = (dataclasses.replace(obj, seed=random.randrange(1<<31), pieces=[piece and strip_prefix(piece) for piece in pp])
+				for pp in combos)
+			given = dups = 0
+			while given < limit:
+				batch = list(itertools.islice(objs, min(CROSSPRODUCT_BATCH, limit - given)))
+				if not batch: break
+				keep, packed = [], []
+				for o in batch:
+					data = o._pack()
+					if data[7:] in seen:
+						dups += 1
+						continue
+					seen.add(data[7:])
+					if total < 10: print(">", o)
+					keep.append(o); packed.append(data)
+				savefile.add_inventory(*keep, packed=packed)
+				given += len(keep)
+			print("Gave", given, "objects" + ", skipped %d duplicates" % dups * (dups > 0))
 			if not fixme: break
 			if fixme == "gr": pieces = get_piece_options(obj) # Give and reset
 		elif fixme == "q": break # Hitting Enter gives those items and breaks; hitting "q" breaks without.
@@ -290,56 +429,76 @@ def tweak(savefile, baseid):
 	def pfx(info): return typeinfo.get("prefixes", [None])
 	@opt
 	def title(info): return typeinfo.get("titles", [None])
+	# Everything that could be chosen gets figured out once, up front: a section
+	# per attribute or piece, each option as (name, display, lowercased display).
+	# The blank section is just a blank line.
+	sections = [(attr, func(info)) for attr, func in get_balance_options.items()]
+	sections.append((None, []))
+	sections.extend((n, list_parts(n)) for n in obj.partnames)
+	sections = [(key, [(opt, strip_prefix(opt) if opt else "None") for opt in options]) for key, options in sections]
+	sections = [(key, [(opt, disp, disp.lower()) for opt, disp in options]) for key, options in sections]
+	# Which options (by index) in each section match a filter. Typing another
+	# letter can only narrow things down, so each filter's matches are found
+	# from the matches for the filter without its last letter; backspacing
+	# then just finds the earlier ones still here.
+	matches = {"": [range(len(options)) for key, options in sections]}
+	def matching(filter):
+		if filter not in matches:
+			matches[filter] = [[i for i in idx if filter in options[i][2]]
+				for (key, options), idx in zip(sections, matching(filter[:-1]))]
+		return matches[filter]
+	def current(key):
+		if key in obj.partnames: return obj.pieces[obj.partnames.index(key)]
+		return getattr(obj, key)
+	def layout(filter):
+		"""Figure out every line to show, and which lines are selectable options"""
+		lines = [("Balance: %s" % obj.balance, True)]
+		choices = [] # (line number, key, option)
+		for (key, options), idx in zip(sections, matching(filter)):
+			if key is None:
+				lines.append(("", False))
+				continue
+			active = current(key)
+			lines.append(("%s: %s" % (key, active), True))
+			if len(options) == 1 and str(options[0][0]).endswith(str(active)):
+				# The only option is the selected one. Don't bother
+				# showing additional options. Note that this is checked
+				# before the filter is, so filtering down to just the
+				# selected one will still maintain consistency.
+				continue
+			for i in idx:
+				choices.append((len(lines), key, options[i][1]))
+				lines.append(("\t" + options[i][1], False))
+		return lines, choices
 	import curses
 	@curses.wrapper
 	def _tweak(stdscr):
 		curses.set_escdelay(10)
 		filter = ""
 		scroll = sel = 0
+		follow = False # Scroll to make the selection visible?
+		shown = { } # What's on each screen line now, so only the changed ones get redrawn
 		while "interactive":
-			line = need = maxsel = selectme = 0
-			def printf(str="", *args, attr=curses.A_NORMAL, keep=3):
-				if args: str = str % tuple(args)
-				nonlocal line
-				if line - scroll > stdscr.getmaxyx()[0] - keep: # Need scrolling
-					nonlocal need
-					need += 1
-					return
-				if line >= scroll:
-					stdscr.addstr(line - scroll, 0, str, attr)
-					stdscr.clrtoeol()
-				line += 1
-			printf("Balance: %s", obj.balance, attr=curses.A_BOLD)
-			def show_piece(key, active, options):
-				printf("%s: %s", key, active, attr=curses.A_BOLD)
-				if len(options) == 1 and str(options[0]).endswith(str(active)):
-					# The only option is the selected one. Don't bother
-					# showing additional options. Note that this is checked
-					# before the filter is, so filtering down to just the
-					# selected one will still maintain consistency.
-					return
-				for opt in options:
-					opt = strip_prefix(opt) if opt else "None"
-					if filter in opt.lower():
-						nonlocal maxsel
-						maxsel += 1
-						printf("%s\t%s", "->" if maxsel == sel else "", opt)
-						if maxsel == sel:
-							nonlocal selectme
-							selectme = (key, opt)
-			for attr, func in get_balance_options.items():
-				show_piece(attr, getattr(obj, attr), func(info))
-			printf()
-			for n, piece in zip(obj.partnames, obj.pieces):
-				show_piece(n, piece, list_parts(n))
-			printf(keep=2)
-			for l in range(line, stdscr.getmaxyx()[0]):
-				stdscr.move(l, 0)
+			lines, choices = layout(filter)
+			height = stdscr.getmaxyx()[0] - 2 # Leave room for a blank line and the prompt
+			selectme = choices[sel - 1] if 0 < sel <= len(choices) else None
+			if selectme:
+				lines[selectme[0]] = ("->" + lines[selectme[0]][0], False)
+				if follow: scroll = min(max(scroll, selectme[0] - height + 1), selectme[0])
+			scroll = max(min(scroll, len(lines) - height), 0)
+			need = max(len(lines) - scroll - height, 0)
+			screen = lines[scroll:scroll + height] + [("", False), ("(+%d)> %s" % (need, filter) if need else "> %s" % filter, True)]
+			prompt = len(screen) - 1
+			screen += [("", False)] * (height + 2 - len(screen))
+			for y, line in enumerate(screen):
+				if shown.get(y) == line: continue
+				stdscr.addstr(y, 0, line[0], curses.A_BOLD if line[1] else curses.A_NORMAL)
 				stdscr.clrtoeol()
-			if need: printf("(+%d)> %s", need, filter, attr=curses.A_BOLD, keep=1)
-			else: printf("> %s", filter, attr=curses.A_BOLD, keep=1)
+				shown[y] = line
+			stdscr.move(prompt, len(screen[prompt][0]))
 			stdscr.refresh()
 			key = stdscr.getkey()
+			follow = False
 			# Filter, select, enter to change item. Example: Typing "maliwan" will let
 			# you go "enter, down, enter, down, enter" to make an all-Maliwan item.
 			if key == "\x1b":
@@ -350,24 +509,31 @@ def tweak(savefile, baseid):
 			elif key in ("KEY_SF", "kDN5") and need: scroll += 1
 			elif key in ("KEY_SR", "kUP5") and scroll: scroll -= 1
 			elif key == "KEY_DOWN":
-				if sel < maxsel: sel += 1
+				if sel < len(choices): sel += 1
 				else: sel = 1
+				follow = True
 			elif key == "KEY_UP":
 				if sel > 1: sel -= 1
-				else: sel = maxsel
+				else: sel = len(choices)
+				follow = True
 			elif len(key) == 1 and ('A' <= key <= 'Z' or 'a' <= key <= 'z' or '0' <= key <= '9'):
 				filter += key.lower()
 			elif key == "KEY_BACKSPACE" and filter:
 				filter = filter[:-1]
 			elif key == "\n" and selectme:
 				# Ugh, don't like this.
-				if selectme[0] in obj.partnames:
-					obj.pieces[obj.partnames.index(selectme[0])] = selectme[1] if selectme[1] != "None" else None
+				_, attr, opt = selectme
+				if attr in obj.partnames:
+					obj.pieces[obj.partnames.index(attr)] = opt if opt != "None" else None
 				else:
-					setattr(obj, selectme[0], selectme[1] if selectme[1] != "None" else None)
+					setattr(obj, attr, opt if opt != "None" else None)
 			elif key == "KEY_ENTER": # Keypad enter to take the item
 				obj.seed = random.randrange(1<<31)
 				savefile.add_inventory(obj)
+			elif key == "KEY_RESIZE":
+				# Everything might have moved, so redraw the lot
+				stdscr.clear()
+				shown.clear()
 			elif key == "KEY_IC": filter = repr(stdscr.getkey()) # Debug - hit Insert then a key to see its name
 
 parser = argparse.ArgumentParser(description="Borderlands 2/Pre-Sequel save file reader")
@@ -382,7 +548,9 @@ parser.add_argument("--native", help="Read savefiles from native Linux installat
 	action="store_const", const="native", dest="platform")
 parser.set_defaults(platform="native")
 parser.add_argument("--player", help="Choose which player (by Steam ID) to view savefiles of")
-parser.add_argument("--verify", help="Verify code internals by attempting to back-encode", action="store_true")
+parser.add_argument("--verify", help="Verify code internals by attempting to back-encode, instead of listing (exits 1 on any failure)", action="store_true")
+parser.add_argument("--verify-chunked", help="Check that a generated save of several LZO blocks round-trips (exits 1 on failure)", action="store_true")
+parser.add_argument("--verify-sample", help="With --verify, only check this many (randomly chosen) items per save; 0 for all", type=int, default=0)
 parser.add_argument("--pieces", help="Show the individual pieces inside weapons/items", action="store_true")
 parser.add_argument("--raw", help="Show the raw details of weapons/items (spammy - use loot filters)", action="store_true")
 parser.add_argument("--itemids", help="Show the IDs of weapons/items", action="store_true")
@@ -390,9 +558,37 @@ parser.add_argument("--synth", help="Synthesize a modified save file", type=synt
 parser.add_argument("-l", "--loot-filter", help="Show loot, optionally filtered to only what's interesting", type=loot_filter, nargs="*")
 parser.add_argument("-f", "--file", help="Process only one save file")
 parser.add_argument("--dir", help="Specify the savefile directory explicitly (ignores --proton/--native and --player)")
-parser.add_argument("--library", help="Add an item ID to the library")
-parser.add_argument("--compare", nargs=2, help="Compare two library items (or potential library items)")
+parser.add_argument("--library", help="Add item IDs to the library: comma-separated, a file of them, or 'input' for stdin", nargs="+")
+parser.add_argument("-q", "--query", help="Search every character's inventory and bank (via an index, updated as needed)", type=query, nargs="*")
+parser.add_argument("--compare", nargs="+", help="Compare library items (or potential library items), by ID or library name")
+parser.add_argument("--profile", help="Report cache hit rates on exit", action="store_true")
+parser.add_argument("--profile-startup", help="Time loading the asset files cold (from JSON) and warm (from the cache)", action="store_true")
+parser.add_argument("--precompute-balances", help="Resolve every BalanceDef up front and save them into the asset cache", action="store_true")
+parser.add_argument("-j", "--jobs", help="Scan this many save files in parallel", type=int, default=1)
+parser.add_argument("--codec-rounds", help="With --benchmark, also time this many protobuf decode/encode round trips", type=int, default=0)
+parser.add_argument("--benchmark", help="Time each stage of decoding the save file(s) instead of listing them", action="store_true")
+parser.add_argument("--benchmark-synthetic", help="Benchmark generated saves of the given sizes (weapons[:items[:bank[:seed]]]), giving JSON", nargs="+", metavar="SPEC")
+parser.add_argument("--benchmark-output", help="Write the --benchmark-synthetic results to this file rather than stdout")
+parser.add_argument("--benchmark-memory", help="Load every save file at once, items and all, and report how much memory it takes", action="store_true")
+parser.add_argument("--watch", help="Keep watching for saves (needs pyinotify), and show what changed in their inventories", action="store_true")
+parser.add_argument("--serve", help="Stay running, with everything loaded, to answer --client requests", action="store_true")
+parser.add_argument("--client", help="Have a --serve process do everything else on this command line", action="store_true")
 args = parser.parse_args()
+
+# Where --serve listens, and how often it looks for changed saves (in seconds)
+SERVE_SOCKET = os.path.expanduser(os.environ.get("BL2_SOCKET", "~/.cache/bl2_find_items.sock"))
+SERVE_POLL = 2.0
+if args.client:
+	# Everything else can be skipped - the server has already done it. So can print(args),
+	# so that the output is exactly what the server sends back.
+	argv = [arg for arg in sys.argv[1:] if arg != "--client"]
+	with socket.socket(socket.AF_UNIX) as sock:
+		try: sock.connect(SERVE_SOCKET)
+		except (FileNotFoundError, ConnectionRefusedError): sys.exit("No server running (start one with --serve)")
+		sock.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+		response = json.loads(b"".join(iter(lambda: sock.recv(65536), b"")))
+	print(response["output"], end="")
+	sys.exit(response["status"])
 print(args)
 
 GAME = args.game
@@ -602,47 +798,243 @@ library = {
 	},
 }
 
+# Anything added with --library goes into this file, rather than needing to be
+# pasted into the above. It's tab-separated: game, ID, name, one item per line,
+# and only ever appended to, so it's safe to edit or merge by hand.
+LIBRARY_FILE = os.path.expanduser(os.environ.get("BL2_LIBRARY", "~/.local/share/bl2_library.tsv"))
+LIBRARY_BATCH = 256 # IDs are normalized this many at a time
+
+def load_library(game=GAME):
+	"""Get the full library for a game (built-in and from the file), as {ID: name}"""
+	lib = dict(library.get(game, { }))
+	try:
+		with open(LIBRARY_FILE, encoding="utf-8") as f:
+			for line in f:
+				fields = line.rstrip("\n").split("\t", 2)
+				if len(fields) == 3 and fields[0] == game: lib.setdefault(fields[1], fields[2])
+	except FileNotFoundError: pass
+	return lib
+
 # Requires access to the Gibbed data files. One version works on pre-Commander-Lilith game files,
 # the other on post-Commander, since that update changed a bunch of stuff.
 ASSET_PATH = "../GibbedBL2/Gibbed.Borderlands{game}/projects/Gibbed.Borderlands{game}.GameInfo/Resources/{fn}.json"
 ASSET_PATH = "../Borderlands{game}Dumps/{fn}.json"
+# Relative to where we started, even once --serve has changed directory for a client
+ASSET_PATH = os.path.abspath(ASSET_PATH)
+def asset_path(fn):
+	if GAME == "borderlands 2": return ASSET_PATH.format(game="2", fn=fn)
+	return ASSET_PATH.format(game="Oz", fn=fn)
+
+# The JSON dumps are big and slow to parse, and most runs only need a small
+# part of them, so they get compiled into an SQLite database alongside the
+# dumps themselves. Each top-level key is stored (pickled) as its own row,
+# and is only loaded when something asks for it. A file is recompiled if its
+# mtime or size no longer match what was compiled; bump the version number
+# if the layout of the cache changes.
+ASSET_CACHE = "asset_cache.sqlite3"
+ASSET_CACHE_VERSION = 3
+ASSET_CACHE_TABLES = {
+	"files": "fn text primary key, mtime real, size integer",
+	"assets": "fn text, key text, value blob, primary key (fn, key)",
+	# Indices etc built from the assets, tagged with the files they were built from
+	"derived": "name text primary key, stamp text, value blob",
+}
+def asset_cache_db(path, conn={}):
+	dbfn = os.path.join(os.path.dirname(path), ASSET_CACHE)
+	# Connections mustn't be shared across a fork (see --jobs), so each process gets its own.
+	key = os.getpid(), dbfn
+	if key not in conn:
+		db = conn[key] = sqlite3.connect(dbfn)
+		if db.execute("pragma user_version").fetchone()[0] != ASSET_CACHE_VERSION:
+			for table in ASSET_CACHE_TABLES: db.execute("drop table if exists " + table)
+			db.execute("pragma user_version = %d" % ASSET_CACHE_VERSION)
+		for table, columns in ASSET_CACHE_TABLES.items():
+			db.execute("create table if not exists %s (%s)" % (table, columns))
+		db.commit()
+	return conn[key]
+
+class CompiledAsset(collections.abc.Mapping):
+	"""Read-mostly view of one JSON asset file, backed by the asset cache
+
+	Anything stored into it (eg derived indices) lives only in memory.
+	"""
+	def __init__(self, fn, path):
+		self.fn = fn
+		self.path = path
+		self.loaded = {}
+		st = os.stat(path)
+		if self.db.execute("select 1 from files where fn = ? and mtime = ? and size = ?",
+				(fn, st.st_mtime, st.st_size)).fetchone(): return
+		with open(path, "rb") as f: data = json.load(f)
+		with self.db:
+			self.db.execute("delete from assets where fn = ?", (fn,))
+			self.db.executemany("insert into assets values (?, ?, ?)",
+				((fn, key, pickle.dumps(val, pickle.HIGHEST_PROTOCOL)) for key, val in data.items()))
+			self.db.execute("insert or replace into files values (?, ?, ?)", (fn, st.st_mtime, st.st_size))
+		self.loaded = data # Might as well keep what we just parsed
+	@property
+	def db(self): return asset_cache_db(self.path)
+	def __getitem__(self, key):
+		if key not in self.loaded:
+			row = self.db.execute("select value from assets where fn = ? and key = ?", (self.fn, key)).fetchone()
+			if not row: raise KeyError(key)
+			self.loaded[key] = pickle.loads(row[0])
+		return self.loaded[key]
+	def __setitem__(self, key, val): self.loaded[key] = val
+	def items(self):
+		# Load the lot in one query, rather than one query per key
+		for key, val in self.db.execute("select key, value from assets where fn = ? order by rowid", (self.fn,)):
+			if key not in self.loaded: self.loaded[key] = pickle.loads(val)
+		return self.loaded.items()
+	def __contains__(self, key):
+		return key in self.loaded or self.db.execute("select 1 from assets where fn = ? and key = ?", (self.fn, key)).fetchone() is not None
+	def keys(self):
+		keys = [key for key, in self.db.execute("select key from assets where fn = ? order by rowid", (self.fn,))]
+		stored = set(keys)
+		return keys + [key for key in self.loaded if key not in stored]
+	def __iter__(self): return iter(self.keys())
+	def __len__(self): return len(self.keys())
+
+def derived_stamp(sources):
+	paths = [asset_path(fn) for fn in sources]
+	return paths[0], ";".join("%r:%d" % (st.st_mtime, st.st_size) for st in map(os.stat, paths))
+
+def get_derived(name, sources, build=None, rebuild=False):
+	"""Get something built from the given asset files, using the cached copy if still valid
+
+	With no build function, returns None if there's nothing (valid) in the cache.
+	"""
+	path, stamp = derived_stamp(sources)
+	try:
+		db = asset_cache_db(path)
+		row = db.execute("select value from derived where name = ? and stamp = ?", (name, stamp)).fetchone()
+	except sqlite3.Error: return build and build() # No cache, no problem, just slower.
+	if row and not rebuild:
+		# If it was pickled by a different incarnation of this script (eg imported
+		# as a module rather than run directly), it won't load; just rebuild it.
+		try: return pickle.loads(row[0])
+		except (pickle.UnpicklingError, AttributeError, ImportError): pass
+	if not build: return None
+	ret = build()
+	with db: db.execute("insert or replace into derived values (?, ?, ?)", (name, stamp, pickle.dumps(ret, pickle.HIGHEST_PROTOCOL)))
+	return ret
+
+def store_derived(values, sources):
+	"""Store a batch of name:value pairs as if each had been built by get_derived"""
+	path, stamp = derived_stamp(sources)
+	db = asset_cache_db(path)
+	with db: db.executemany("insert or replace into derived values (?, ?, ?)",
+		[(name, stamp, pickle.dumps(val, pickle.HIGHEST_PROTOCOL)) for name, val in values.items()])
+
 def get_asset(fn, cache={}):
 	if fn not in cache:
-		if GAME == "borderlands 2": path = ASSET_PATH.format(game="2", fn=fn)
-		else: path = ASSET_PATH.format(game="Oz", fn=fn)
-		with open(path, "rb") as f: cache[fn] = json.load(f)
+		path = asset_path(fn)
+		try: cache[fn] = CompiledAsset(fn, path)
+		except sqlite3.Error:
+			# Can't use the cache (read-only directory?), so do it the slow way.
+			with open(path, "rb") as f: cache[fn] = json.load(f)
 	return cache[fn]
 
+ASSET_FILES = [cls + " " + fn for fn in ("Types", "Balance", "Name Parts", "Balance Part Lists", "Part Lists") for cls in ("Weapon", "Item")]
+ASSET_FILES += ["Asset Library Manager", "Player Classes"]
+def report_caches():
+	"""Show how well the caches did, for --profile"""
+	# Only this process's numbers; --jobs workers keep their own.
+	for cache in ("decode", "encode"):
+		hits, misses = cache_stats[cache + " hits"], cache_stats[cache + " misses"]
+		print("Serial %s cache: %d hits, %d misses (%.1f%%)" % (cache, hits, misses, 100 * hits / ((hits + misses) or 1)))
+	for func in (get_balance_info, get_balance_pieces):
+		info = func.cache_info()
+		print("%s: %d hits, %d misses (%.1f%%)" % (func.__name__, info.hits, info.misses, 100 * info.hits / ((info.hits + info.misses) or 1)))
+
+def profile_startup():
+	"""Report how long each asset file takes to load, from JSON and from the cache"""
+	print("%-28s %10s %10s %10s %10s" % ("", "JSON", "Compile", "Warm open", "Warm all"))
+	for fn in ASSET_FILES:
+		path = asset_path(fn)
+		try: os.stat(path)
+		except FileNotFoundError: continue
+		start = time.perf_counter()
+		with open(path, "rb") as f: json.load(f)
+		cold = time.perf_counter()
+		asset_cache_db(path).execute("delete from files where fn = ?", (fn,)) # Force a recompile
+		CompiledAsset(fn, path)
+		compiled = time.perf_counter()
+		asset = CompiledAsset(fn, path)
+		warm = time.perf_counter()
+		for key in asset: asset[key]
+		warm_all = time.perf_counter()
+		print("%-28s %8.1fms %8.1fms %8.1fms %8.1fms" % (fn, (cold - start) * 1000,
+			(compiled - cold) * 1000, (warm - compiled) * 1000, (warm_all - warm) * 1000))
+
 def get_asset_library_manager():
 	config = get_asset("Asset Library Manager")
-	if "_sets_by_id" not in config:
-		# Remap the sets to be keyed by ID - it's more useful that way.
-		config["_sets_by_id"] = {set["id"]: set for set in config["sets"]}
-	# Build a mapping from item identifier to (set,subid,asset) triple.
 	if "_find_asset" not in config:
-		cfg = config["_find_asset"] = collections.defaultdict(dict)
-		for set in config["sets"]:
-			for field, libinfo in set["libraries"].items():
-				for sublib, info in enumerate(libinfo["sublibraries"]):
-					for asset, name in enumerate(info.get("assets", [])):
-						# HACK: Exclude everything from the Commander Lilith DLC
-						# I'm seeing a bunch of duplication that is causing issues.
-						if "Anemone" in info["package"]: continue
-						if args.verify and name in cfg[field]:
-							print("Got duplicate", field, name, cfg[field][name], (set["id"], sublib, asset))
-						cfg[field][name] = set["id"], sublib, asset, info["package"]
+		def build():
+			# Remap the sets to be keyed by ID - it's more useful that way.
+			sets_by_id = {set["id"]: set for set in config["sets"]}
+			# Build a mapping from item identifier to (set,subid,asset) triple.
+			cfg = collections.defaultdict(dict)
+			for set in config["sets"]:
+				for field, libinfo in set["libraries"].items():
+					for sublib, info in enumerate(libinfo["sublibraries"]):
+						for asset, name in enumerate(info.get("assets", [])):
+							# HACK: Exclude everything from the Commander Lilith DLC
+							# I'm seeing a bunch of duplication that is causing issues.
+							if "Anemone" in info["package"]: continue
+							if args.verify and name in cfg[field]:
+								print("Got duplicate", field, name, cfg[field][name], (set["id"], sublib, asset))
+							cfg[field][name] = set["id"], sublib, asset, info["package"]
+			return sets_by_id, cfg
+		# With --verify, always rebuild, so the duplicates get reported.
+		config["_sets_by_id"], config["_find_asset"] = get_derived("asset library indices",
+			["Asset Library Manager"], build, rebuild=args.verify)
 	return config
 
-def get_balance_info(is_weapon, balance):
-	cls = "Weapon" if is_weapon else "Item"
-	allbal = get_asset(cls + " Balance")
-	if balance not in allbal:
-		# If something goes wrong, this will probably KeyError either looking up the BalanceDef, or in the subsequent lookup in allbal.
-		config = get_asset_library_manager()
-		setid, sublib, asset, cat = config["_find_asset"]["BalanceDefs"][balance]
-		balance = cat + "." + balance
-	info = allbal[balance]
-	base = get_balance_info(is_weapon, info["base"]) if "base" in info else {"parts": { }}
+def get_display_names():
+	"""Get the lookup tables used by get_title(), mapping asset names to what the game shows
+
+	"types" maps each weapon/item type to its name if that alone is the full
+	title of the item, or None if it needs a prefix and title; "parts" maps
+	each part to its name, if it has one.
+	"""
+	config = get_asset_library_manager()
+	if "_display_names" not in config:
+		def build():
+			ret = {"types": {}, "parts": {}}
+			for weap_item in ("Weapon", "Item"):
+				typeinfos = get_asset(weap_item + " Types")
+				ret["types"][weap_item] = {
+					name: typeinfo["name"] if typeinfo.get("has_full_name") else None
+					for name, (setid, sublib, asset, cat) in config["_find_asset"][weap_item + "Types"].items()
+					for typeinfo in [typeinfos.get(cat + "." + name)] if typeinfo is not None
+				}
+				names = dict(get_asset(weap_item + " Name Parts").items())
+				ret["parts"][weap_item] = {
+					name: (names.get(cat + "." + name) or {}).get("name")
+					for name, (setid, sublib, asset, cat) in config["_find_asset"][weap_item + "Parts"].items()
+				}
+			return ret
+		config["_display_names"] = get_derived("display names", ["Asset Library Manager",
+			"Weapon Types", "Item Types", "Weapon Name Parts", "Item Name Parts"], build)
+	return config["_display_names"]
+
+def freeze(obj):
+	"""Make a read-only copy of some JSON-like data: dicts become mappingproxies, lists become tuples"""
+	if isinstance(obj, dict): return types.MappingProxyType({k: freeze(v) for k, v in obj.items()})
+	if isinstance(obj, list): return tuple(freeze(v) for v in obj)
+	return obj
+
+def resolve_balance(cls, balance, memo):
+	"""Flatten a BalanceDef and everything it inherits from
+
+	Bases get resolved (and remembered in memo) along the way. Returns plain
+	dicts and lists, which may be shared with other entries in memo, so
+	don't mutate them; get_balance_info() gives out frozen copies.
+	"""
+	if balance in memo: return memo[balance]
+	info = get_asset(cls + " Balance")[balance]
+	base = resolve_balance(cls, info["base"], memo) if "base" in info else {"parts": { }}
 	ret = {k:v for k,v in base.items() if k != "parts"}
 	for k,v in info.items():
 		if k == "parts":
@@ -662,34 +1054,162 @@ def get_balance_info(is_weapon, balance):
 				else:
 					ret["parts"][part] = opts
 		elif k != "base": ret[k] = v # Don't copy in the base once it's rendered
+	memo[balance] = ret
 	return ret
 
-class ConsumableLE(Consumable):
-	"""Little-endian bitwise consumable"""
+def balance_sources(cls): return [cls + " Balance", cls + " Balance Part Lists"]
+
+@functools.lru_cache(maxsize=1024)
+def get_balance_info(is_weapon, balance):
+	"""Get the fully-resolved (see resolve_balance) BalanceDef for a weapon/item
+
+	The result is read-only, as it is shared with every other caller asking
+	for the same balance. If --precompute-balances has been run, it comes
+	straight from the asset cache.
+	"""
+	cls = "Weapon" if is_weapon else "Item"
+	allbal = get_asset(cls + " Balance")
+	if balance not in allbal:
+		# If something goes wrong, this will probably KeyError either looking up the BalanceDef, or in the subsequent lookup in allbal.
+		config = get_asset_library_manager()
+		setid, sublib, asset, cat = config["_find_asset"]["BalanceDefs"][balance]
+		balance = cat + "." + balance
+	info = get_derived(cls + " Balance/" + balance, balance_sources(cls))
+	if info is None: info = resolve_balance(cls, balance, { })
+	return freeze(info)
+
+def precompute_balances():
+	"""Resolve every BalanceDef and save them all into the asset cache"""
+	for cls in "Weapon", "Item":
+		start = time.time()
+		allbal = get_asset(cls + " Balance")
+		memo = { }
+		for balance, _ in allbal.items():
+			# Some balances have broken bases; they'll fail just the same when used.
+			try: resolve_balance(cls, balance, memo)
+			except KeyError: pass
+		store_derived({cls + " Balance/" + balance: info for balance, info in memo.items()}, balance_sources(cls))
+		print("%s: resolved %d balances in %.3fs" % (cls, len(memo), time.time() - start))
+
+class BitReader:
+	"""Bitwise consumable, reading from packed eight-bit data
+
+	Bits are taken most significant first, and get() returns them as an
+	integer. Equivalent to Consumable.from_bits() followed by int(get(n), 2),
+	but without exploding every byte into eight characters of "0" and "1".
+	"""
+	def __init__(self, data):
+		self.data = bytes(data)
+		self.pos = 0 # Measured in bits, not bytes
+		self.end = len(self.data) * 8
 	def get(self, num):
-		return super().get(num)[::-1]
-	@classmethod
-	def from_bits(cls, data):
-		"""Create a bitfield consumable from packed eight-bit data"""
-		return cls(''.join(format(x, "08b")[::-1] for x in data))
+		"""Destructively read the next num bits"""
+		pos = self.pos; end = pos + num
+		if end > self.end: raise ValueError("Out of data!")
+		self.pos = end
+		if num == 1: return (self.data[pos >> 3] >> (7 - (pos & 7))) & 1 # Fast path for the commonest case
+		stop = (end + 7) >> 3
+		return (int.from_bytes(self.data[pos >> 3 : stop], "big") >> (stop * 8 - end)) & ((1 << num) - 1)
+	def __len__(self): return self.end - self.pos
+	def peek(self):
+		"""Return all remaining bits (there are len(self) of them) without consuming"""
+		return int.from_bytes(self.data[self.pos >> 3:], "big") & ((1 << len(self)) - 1)
 
-def bogocrypt(seed, data, direction="decrypt"):
-	if not seed: return data
-	split = (seed % 32) % len(data)
-	if direction == "encrypt": # Encrypting splits first
-		data = data[split:] + data[:split]
+class BitReaderLE(BitReader):
+	"""Little-endian bitwise consumable - each byte is read from its low bit up"""
+	def get(self, num):
+		pos = self.pos; end = pos + num
+		if end > self.end: raise ValueError("Out of data!")
+		self.pos = end
+		return (int.from_bytes(self.data[pos >> 3 : (end + 7) >> 3], "little") >> (pos & 7)) & ((1 << num) - 1)
+	def peek(self):
+		return int.from_bytes(self.data[self.pos >> 3:], "little") >> (self.pos & 7)
+
+class BitWriter:
+	"""Counterpart to BitReader: accumulate integers of any bit width into packed bytes"""
+	def __init__(self):
+		self.data = bytearray()
+		self.acc = self.bits = 0 # Bits not yet flushed to data (always fewer than eight between calls)
+	def put(self, val, num):
+		self.acc = (self.acc << num) | val
+		self.bits += num
+		if self.bits >= 8:
+			nbytes = self.bits >> 3
+			self.bits &= 7
+			self.data += (self.acc >> self.bits).to_bytes(nbytes, "big")
+			self.acc &= (1 << self.bits) - 1
+	def __len__(self): return len(self.data) * 8 + self.bits
+	def getvalue(self):
+		"""Return the packed bytes. Any partial byte must be padded out by the caller first."""
+		if self.bits: raise ValueError("Incomplete final byte (%d bits)" % self.bits)
+		return bytes(self.data)
+
+class BitWriterLE(BitWriter):
+	"""Counterpart to BitReaderLE"""
+	def put(self, val, num):
+		self.acc |= val << self.bits
+		self.bits += num
+		if self.bits >= 8:
+			nbytes = self.bits >> 3
+			self.data += (self.acc & ((1 << (nbytes * 8)) - 1)).to_bytes(nbytes, "little")
+			self.acc >>= nbytes * 8
+			self.bits &= 7
+
+@functools.lru_cache(maxsize=65536)
+def bogocrypt_keystream(seed, length):
+	"""Generate the bytes that bogocrypt XORs length bytes of data with"""
 	if seed > 1<<31: seed |= 31<<32 # Emulate an arithmetic right shift
 	xor = seed >> 5
-	data = list(data)
-	for i, x in enumerate(data):
+	key = bytearray(length)
+	for i in range(length):
 		# ??? No idea. Got this straight from Gibbed.
 		xor = (xor * 0x10A860C1) % 0xFFFFFFFB
-		data[i] = x ^ (xor & 255)
-	data = bytes(data)
-	if direction == "encrypt": return data
-	return data[-split:] + data[:-split] # Decrypting splits last
+		key[i] = xor & 255
+	return bytes(key)
 
-@dataclass
+def bogocrypt_batch(items, direction="decrypt"):
+	"""Encrypt or decrypt any number of (seed, data) pairs in one go
+
+	All the data is concatenated and XORed against the concatenated
+	keystreams as a single (very big) integer, then split back up. The
+	keystreams are memoized per seed, so a serial that's decrypted and
+	then re-encrypted only pays for the generator once.
+	"""
+	if not items: return []
+	chunks = []; keys = []
+	for seed, data in items:
+		if seed and data:
+			split = (seed % 32) % len(data)
+			if direction == "encrypt": # Encrypting splits first
+				data = data[split:] + data[:split]
+			keys.append(bogocrypt_keystream(seed, len(data)))
+		else: keys.append(bytes(len(data))) # Seed of zero means no encryption
+		chunks.append(data)
+	data = b"".join(chunks)
+	data = (int.from_bytes(data, "big") ^ int.from_bytes(b"".join(keys), "big")).to_bytes(len(data), "big")
+	ret = []; pos = 0
+	for (seed, _), chunk in zip(items, chunks):
+		chunk = data[pos : pos + len(chunk)]
+		pos += len(chunk)
+		if seed and chunk and direction != "encrypt":
+			split = (seed % 32) % len(chunk)
+			chunk = chunk[-split:] + chunk[:-split] # Decrypting splits last
+		ret.append(chunk)
+	return ret
+
+def bogocrypt(seed, data, direction="decrypt"):
+	return bogocrypt_batch([(seed, data)], direction)[0]
+
+DECODE_CACHE_SIZE = 4096 # Decoded serials to keep (see Asset.decode_asset_libraries)
+cache_stats = collections.Counter() # Hits and misses for the serial caches, for --profile
+
+# There can be a lot of these around (every item in every bank, and the
+# messages they come in), so they don't get a __dict__ each, if this Python
+# can do that (3.10+). Anything that needs to hang extra attributes on them
+# has to have a field for it.
+SLOTS = {"slots": True} if sys.version_info >= (3, 10) else { }
+
+@dataclass(**SLOTS)
 class Asset:
 	seed: None
 	is_weapon: None
@@ -704,22 +1224,80 @@ class Asset:
 	material: "*Parts"
 	pfx: "*Parts"
 	title: "*Parts"
+	# Encoding remembers what it encoded to, and what the object looked like at
+	# the time. Any change to any field (including to a piece) invalidates it.
+	_serial: None = dataclasses.field(default=(None, None), repr=False, compare=False)
 	@property
 	def partnames(self): return partnames(self.is_weapon) # Convenience lookup property
 
 	@classmethod
 	def decode_asset_library(cls, data):
-		orig = data
-		seed = int.from_bytes(data[1:5], "big")
-		dec = data[:5] + bogocrypt(seed, data[5:], "decrypt")
-		if args.verify:
-			reconstructed = dec[:5] + bogocrypt(seed, dec[5:], "encrypt")
-			if data != reconstructed:
-				print("Imperfect reconstruction of weapon/item:")
-				print(data)
-				print(reconstructed)
-				raise AssertionError
-		data = dec + b"\xFF" * (40 - len(dec)) # Pad to 40 with 0xFF
+		return cls.decode_asset_libraries([data])[0]
+
+	# The same serials get decoded over and over (listing, then synthesizers,
+	# then again for the next save with the same things in its bank), so the
+	# most recent decodes are kept, by serial. Callers get copies, since they
+	# are quite welcome to mutate what they're given.
+	_decoded = collections.OrderedDict()
+
+	@classmethod
+	def decode_asset_libraries(cls, serials, fields=None):
+		"""Decode a batch of serials, decrypting them all together
+
+		If fields is given, only those fields get looked up, and decoding stops
+		after the last of them; everything else is left as None. (Unless it's
+		already been fully decoded, in which case it's all there anyway.)
+		"""
+		ret = [None] * len(serials)
+		missing = []
+		for i, serial in enumerate(serials):
+			obj = cls._decoded.get(serial, cache_stats) # (anything that can't be a cached value)
+			if obj is cache_stats: missing.append(i)
+			else:
+				cls._decoded.move_to_end(serial)
+				ret[i] = obj and obj.copy()
+		cache_stats["decode hits"] += len(serials) - len(missing)
+		cache_stats["decode misses"] += len(missing)
+		for i, obj in zip(missing, cls._decode_batch([serials[i] for i in missing], fields)):
+			ret[i] = obj
+			if fields is not None: continue # Partial decodes don't get cached
+			if obj: obj._serial = obj._state(), serials[i] # Encoding it will give back the same thing
+			cls._decoded[serials[i]] = obj and obj.copy()
+		while len(cls._decoded) > DECODE_CACHE_SIZE: cls._decoded.popitem(last=False)
+		return ret
+
+	@classmethod
+	def _decode_batch(cls, serials, fields=None):
+		seeds = [int.from_bytes(data[1:5], "big") for data in serials]
+		decrypted = bogocrypt_batch([(seed, data[5:]) for seed, data in zip(seeds, serials)], "decrypt")
+		return [cls._decode_decrypted(seed, data[:5] + dec, fields) for seed, data, dec in zip(seeds, serials, decrypted)]
+
+	def copy(self): return dataclasses.replace(self, pieces=list(self.pieces))
+
+	def _state(self): return tuple(tuple(v) if isinstance(v, list) else v for v in map(self.__getattribute__, self._state_fields))
+
+	@classmethod
+	def verify_serials(cls, serials):
+		"""Check that a batch of serials decrypt, decode, encode and encrypt back to themselves
+
+		Raises AssertionError if not.
+		"""
+		seeds = [int.from_bytes(data[1:5], "big") for data in serials]
+		decrypted = bogocrypt_batch([(seed, data[5:]) for seed, data in zip(seeds, serials)], "decrypt")
+		reconstructed = bogocrypt_batch(list(zip(seeds, decrypted)), "encrypt")
+		for data, recon in zip(serials, reconstructed):
+			if data[5:] != recon:
+				raise AssertionError("Imperfect reconstruction of weapon/item:\n%r\n%r" % (data, data[:5] + recon))
+		# Bypass the caches, which would otherwise just give back the originals
+		pairs = [(data, obj) for data, obj in zip(serials, cls._decode_batch(serials)) if obj]
+		objs = [obj for data, obj in pairs]
+		for (data, obj), recon in zip(pairs, cls.encode_asset_libraries(objs, [obj._pack() for obj in objs])):
+			if recon != data:
+				raise AssertionError("Weapon reconstruction does not match original: %r" % obj)
+
+	@classmethod
+	def _decode_decrypted(cls, seed, data, fields=None):
+		data = data + b"\xFF" * (40 - len(data)) # Pad to 40 with 0xFF
 		crc16 = int.from_bytes(data[5:7], "big")
 		data = data[:5] + b"\xFF\xFF" + data[7:]
 		crc = binascii.crc32(data)
@@ -734,39 +1312,82 @@ class Asset:
 		uid = int.from_bytes(data[1:5], "little")
 		if not uid: return None # For some reason, there are a couple of null items at the end of inventory. They decode fine but aren't items.
 		setid = data[7]
-		bits = ConsumableLE.from_bits(data[8:])
+		bits = BitReaderLE(data[8:])
 		def _decode(field):
 			cfg = config["configs"][field]
-			asset = bits.get(cfg["asset_bits"])
-			sublib = bits.get(cfg["sublibrary_bits"] - 1)
-			useset = bits.get(1)
-			if "0" not in (useset+sublib+asset): return None # All -1 means "nothing here"
-			cfg = config["_sets_by_id"][setid if useset == "1" else 0]["libraries"][field]
-			# print(field, cfg["sublibraries"][int(sublib,2)]["assets"][int(asset,2)])
-			return cfg["sublibraries"][int(sublib,2)]["assets"][int(asset,2)]
+			width = cfg["asset_bits"] + cfg["sublibrary_bits"]
+			# Asset, then sublibrary, then a single bit for "use the set ID"
+			val = bits.get(width)
+			if val == (1 << width) - 1: return None # All -1 means "nothing here"
+			asset = val & ((1 << cfg["asset_bits"]) - 1)
+			sublib = (val >> cfg["asset_bits"]) & ((1 << (cfg["sublibrary_bits"] - 1)) - 1)
+			useset = val >> (width - 1)
+			cfg = config["_sets_by_id"][setid if useset else 0]["libraries"][field]
+			# print(field, cfg["sublibraries"][sublib]["assets"][asset])
+			# Interned, so that every item with this part shares the one string,
+			# even if the library got reloaded (or unpickled) in between.
+			return sys.intern(cfg["sublibraries"][sublib]["assets"][asset])
+
+		def _skip(field):
+			cfg = config["configs"][field]
+			bits.get(cfg["asset_bits"] + cfg["sublibrary_bits"])
 
 		ret = {"seed": seed, "is_weapon": is_weapon}
+		wanted = len(cls.__dataclass_fields__) if fields is None else len(fields)
 		for field, typ in cls.__dataclass_fields__.items():
 			typ = typ.type
 			if typ is None:
 				continue # Not being decoded this way
+			if not wanted:
+				ret[field] = None # Nothing more needed, so don't bother reading on
+				continue
+			if fields is not None and field not in fields:
+				# Not needed, but everything after it is in the bits after it
+				if typ is int: bits.get(7)
+				else:
+					for t in typ if isinstance(typ, list) else [typ]: _skip(t.replace("*", weap_item))
+				ret[field] = None
+				continue
+			wanted -= 1
 			if typ is int:
-				ret[field] = int(bits.get(7), 2)
+				ret[field] = bits.get(7)
 			elif isinstance(typ, str):
 				ret[field] = _decode(typ.replace("*", weap_item))
 			elif isinstance(typ, list):
 				ret[field] = [_decode(t.replace("*", weap_item)) for t in typ]
 			else:
 				raise AssertionError("Bad annotation %r" % typ)
-		ret = cls(**ret)
-		if args.verify:
-			if ret.encode_asset_library() != orig:
-				raise AssertionError("Weapon reconstruction does not match original: %r" % ret)
-		return ret
+		return cls(**ret)
 
 	def encode_asset_library(self):
+		return Asset.encode_asset_libraries([self])[0]
+
+	@staticmethod
+	def encode_asset_libraries(assets, packed=None):
+		"""Encode a batch of assets, encrypting them all together
+
+		If they've already been _pack()ed, pass those in to save redoing it.
+		Otherwise, anything unchanged since it was last encoded (or decoded)
+		gives the same serial as it did then, without doing it all again.
+		"""
+		states = [asset._state() for asset in assets]
+		if packed is None:
+			ret = [asset._serial[1] if asset._serial[0] == state else None for asset, state in zip(assets, states)]
+			todo = [i for i, serial in enumerate(ret) if serial is None]
+			packed = [assets[i]._pack() for i in todo]
+		else: ret, todo = [None] * len(assets), range(len(assets))
+		cache_stats["encode hits"] += len(assets) - len(todo)
+		cache_stats["encode misses"] += len(todo)
+		encrypted = bogocrypt_batch([(assets[i].seed, data[5:]) for i, data in zip(todo, packed)], "encrypt")
+		for i, data, enc in zip(todo, packed, encrypted):
+			ret[i] = data[:5] + enc
+			assets[i]._serial = states[i], ret[i]
+		return ret
+
+	def _pack(self):
+		"""Build the unencrypted serial - the header, the CRC, and the bitfield"""
 		# NOTE: Assumes that at least one decode has been done previously.
-		bits = []
+		bits = BitWriterLE()
 		config = get_asset_library_manager()
 		fields = []
 		needsets = {0}
@@ -774,20 +1395,21 @@ class Asset:
 			cfg = config["configs"][field]
 			fields.append("%s-%d-%d" % (field, cfg["asset_bits"], cfg["sublibrary_bits"]))
 			if item is None:
-				bits.append("1" * (cfg["asset_bits"] + cfg["sublibrary_bits"]))
+				width = cfg["asset_bits"] + cfg["sublibrary_bits"]
+				bits.put((1 << width) - 1, width)
 				return
 			setid, sublib, asset, cat = config["_find_asset"][field][item]
 			needsets.add(setid)
-			bits.append(format(asset, "0%db" % cfg["asset_bits"])[::-1])
-			bits.append(format(sublib, "0%db" % (cfg["sublibrary_bits"]-1))[::-1])
-			bits.append("1" if setid else "0")
+			bits.put(asset, cfg["asset_bits"])
+			bits.put(sublib, cfg["sublibrary_bits"] - 1)
+			bits.put(1 if setid else 0, 1)
 		weap_item = "Weapon" if self.is_weapon else "Item"
 		for field, typ in self.__dataclass_fields__.items():
 			typ = typ.type
 			if typ is None:
 				continue # Not being encoded this way
 			if typ is int:
-				bits.append(format(getattr(self, field), "07b")[::-1])
+				bits.put(getattr(self, field), 7)
 			elif isinstance(typ, str):
 				_encode(typ.replace("*", weap_item), getattr(self, field))
 			elif isinstance(typ, list):
@@ -795,9 +1417,9 @@ class Asset:
 					_encode(t.replace("*", weap_item), piece)
 		if len(needsets) > 2: print("Need multiple set IDs! Cannot encode.", needsets)
 		# Note that needsets might still be {0}, in which case we'll render a setid of 0.
-		bits = "".join(bits)
-		bits += "1" * (8 - (len(bits) % 8))
-		data = int(bits[::-1], 2).to_bytes(len(bits)//8, "little")
+		spare = 8 - (len(bits) % 8)
+		bits.put((1 << spare) - 1, spare)
+		data = bits.getvalue()
 		data = (
 			bytes([config["version"] | (128 if self.is_weapon else 0)]) +
 			self.seed.to_bytes(4, "big") + b"\xFF\xFF" + bytes([max(needsets)]) +
@@ -809,45 +1431,41 @@ class Asset:
 		# data = (data[:5] + crc.to_bytes(2, "big") + data[7:]).rstrip(b"\xFF")
 		# print(' '.join(format(x, "08b")[::-1] for x in data))
 		# print(' '.join(format(x, "08b")[::-1] for x in (dec[:5] + b"\xFF\xFF" + dec[7:])))
-		return data[:5] + bogocrypt(self.seed, (crc.to_bytes(2, "big") + data[7:]).rstrip(b"\xFF"), "encrypt")
+		return data[:5] + (crc.to_bytes(2, "big") + data[7:]).rstrip(b"\xFF")
 
 	def get_title(self):
 		if self.type == "ItemDefs.ID_Ep4_FireHawkMessage": return "FireHawkMessage" # This isn't a real thing and doesn't work properly. (It'll be in the bank when you find out about the Firehawk.)
 		weap_item = "Weapon" if self.is_weapon else "Item"
-		config = get_asset_library_manager()
-		setid, sublib, asset, cat = config["_find_asset"][weap_item + "Types"][self.type]
-		typeinfo = get_asset(weap_item + " Types")[cat + "." + self.type]
-		if typeinfo.get("has_full_name"):
-			# The item's type fully defines its title. This happens with a number
-			# of unique and/or special items.
-			return typeinfo["name"]
+		names = get_display_names()
+		# If the item's type fully defines its title, that's all we need. This
+		# happens with a number of unique and/or special items.
+		title = names["types"][weap_item][self.type]
+		if title: return title
 		# Otherwise, build a name from a prefix (possibly) and a title.
 		# The name parts have categories and I don't yet know how to reliably list them.
-		names = get_asset(weap_item + " Name Parts")
-		pfxinfo = None
-		if self.pfx:
-			setid, sublib, asset, cat = config["_find_asset"][weap_item + "Parts"][self.pfx]
-			pfxinfo = names.get(cat + "." + self.pfx)
-			# pfxinfo has a name (unless it's a null prefix), and a uniqueness flag. No idea what that one is for.
-		if self.title:
-			setid, sublib, asset, cat = config["_find_asset"][weap_item + "Parts"][self.title]
-			titinfo = names.get(cat + "." + self.title)
-			title = titinfo["name"] if titinfo else self.title
+		# The prefix has a name (unless it's a null prefix), and a uniqueness flag. No idea what that one is for.
+		pfx = names["parts"][weap_item][self.pfx] if self.pfx else None
+		if self.title: title = names["parts"][weap_item][self.title] or self.title
 		else: title = "<no title>"
-		if pfxinfo and "name" in pfxinfo: title = pfxinfo["name"] + " " + title
+		if pfx: title = pfx + " " + title
 		return title
 
-	def __repr__(self):
+	def summary(self):
+		"""Describe the item briefly, as __repr__ does before any of the optional extras"""
 		if self.grade == self.stage: lvl = "Lvl %d" % self.grade
 		else: lvl = "Level %d/%d" % (self.grade, self.stage)
 		type = self.type.split(".", 1)[1].replace("WT_", "").replace("WeaponType_", "").replace("_", " ")
-		ret = "%s %s (%s)" % (lvl, self.get_title(), type)
+		return "%s %s (%s)" % (lvl, self.get_title(), type)
+
+	def __repr__(self):
+		ret = self.summary()
 		if args.itemids: ret += " {%s}" % armor_serial(self.encode_asset_library())
 		if args.pieces: ret += "\n" + " + ".join(filter(None, self.pieces))
-		if args.raw: ret += "\n" + ", ".join("%s=%r" % (f, getattr(self, f)) for f in self.__dataclass_fields__)
-		if args.library and "{}" in args.library: args.library += ",{%s}" % armor_serial(self.encode_asset_library())
+		if args.raw: ret += "\n" + ", ".join("%s=%r" % (f, getattr(self, f)) for f in self._state_fields)
+		if args.library and "{}" in args.library: args.library.append("{%s}" % armor_serial(self.encode_asset_library()))
 		return ret
 	#if args.raw: del __repr__ # For a truly-raw view (debugging mode).
+Asset._state_fields = tuple(f for f in Asset.__dataclass_fields__ if not f.startswith("_"))
 
 def decode_tree(bits):
 	"""Decode a (sub)tree from the given sequence of bits
@@ -856,65 +1474,165 @@ def decode_tree(bits):
 	and right). Consumes either a 1 bit and then eight data bits, or
 	a 0 bit and then two subtrees.
 	"""
-	if bits.get(1) == "1": # Is it a leaf?
-		return int(bits.get(8), 2)
+	if bits.get(1): # Is it a leaf?
+		return bits.get(8)
 	# Otherwise, it has subnodes.
 	return (decode_tree(bits), decode_tree(bits))
-def huffman_decode(data, size):
-	bits = Consumable.from_bits(data)
+def huffman_table(root, width):
+	"""Flatten a Huffman tree into a lookup table indexed by the next width bits
+
+	Each entry is a pair (node, length). Usually the node is a leaf (a byte
+	value) and length is the number of bits its code actually occupies, so
+	one lookup resolves one byte. Codes longer than width bits get the
+	subtree reached after width bits, to be walked the slow way from there.
+	"""
+	table = [None] * (1 << width)
+	def fill(node, code, depth):
+		if isinstance(node, tuple) and depth < width:
+			fill(node[0], code << 1, depth + 1)
+			fill(node[1], (code << 1) | 1, depth + 1)
+			return
+		shift = width - depth
+		table[code << shift : (code + 1) << shift] = [(node, depth)] * (1 << shift)
+	fill(root, 0, 0)
+	return table
+
+HUFFMAN_LOOKUP_BITS = 12 # Must be no more than 25, as the window below is 32 bits and may start mid-byte
+def huffman_decode(data, size, details=None):
+	"""Decode size bytes of Huffman-compressed data
+
+	If details is a dict, the tree and the residue (leftover bits) get stored
+	into it, so huffman_encode() can be asked to reproduce the exact same bits.
+	"""
+	bits = BitReader(data)
 	root = decode_tree(bits)
-	global last_huffman_tree; last_huffman_tree = root
-	ret = []
-	while len(ret) < size:
-		cur = root
-		while isinstance(cur, tuple):
-			cur = cur[bits.get(1) == "1"]
-		ret.append(cur)
+	table = huffman_table(root, HUFFMAN_LOOKUP_BITS)
+	shift = 32 - HUFFMAN_LOOKUP_BITS; mask = (1 << HUFFMAN_LOOKUP_BITS) - 1
+	data = bits.data + bytes(4) # Padding so the last few lookups don't run short
+	pos = bits.pos
+	ret = bytearray(size)
+	try:
+		for i in range(size):
+			byte = pos >> 3
+			cur, length = table[(int.from_bytes(data[byte:byte+4], "big") >> (shift - (pos & 7))) & mask]
+			pos += length
+			while isinstance(cur, tuple):
+				cur = cur[(data[pos >> 3] >> (7 - (pos & 7))) & 1]
+				pos += 1
+			ret[i] = cur
+	except IndexError: pos = bits.end + 1 # Ran off the end of the padding. Definitely out of data.
+	if pos > bits.end: raise ValueError("Out of data!")
+	bits.pos = pos
 	# The residue doesn't always consist solely of zero bits. I'm not sure
 	# why, and I have no idea how to replicate it. Hopefully it doesn't
 	# matter.
-	residue = bits.peek()
-	global last_huffman_residue; last_huffman_residue = residue
+	residue = format(bits.peek(), "0%db" % len(bits)) if len(bits) else ""
 	if len(residue) >= 8: raise ValueError("Too much compressed data - residue " + residue)
+	if details is not None: details.update(tree=root, residue=residue)
 	return bytes(ret)
 
-def huffman_encode(data):
-	if not data: return data # Probably wrong but should never happen anyway
-	# First, build a Huffman tree by figuring out which bytes are most common.
+def huffman_tree(data):
+	"""Build a Huffman tree for the given data
+
+	Repeatedly joins the two least common nodes, same as always, but using
+	a heap rather than re-sorting everything for every join. Ties are broken
+	the way Counter.most_common() would (the later-inserted node counts as
+	less common), so the tree is identical to what the sorting version built.
+	"""
 	counts = collections.Counter(data)
-	while len(counts) > 1:
+	heap = [(freq, -seq, node) for seq, (node, freq) in enumerate(counts.items())]
+	heapq.heapify(heap)
+	seq = len(heap)
+	while len(heap) > 1:
 		# Pick the two least common and join them
-		(left, lfreq), (right, rfreq) = counts.most_common()[-2:]
-		del counts[left], counts[right]
-		counts[(left, right)] = lfreq + rfreq
-	[head] = counts # Grab the sole remaining key
-	if args.verify: head = last_huffman_tree # Hack: Reuse the tree from the last decode (gives bit-for-bit identical compression)
+		rfreq, _, right = heapq.heappop(heap)
+		lfreq, _, left = heapq.heappop(heap)
+		heapq.heappush(heap, (lfreq + rfreq, -seq, (left, right)))
+		seq += 1
+	return heap[0][2]
+
+def huffman_encode(data, tree=None, residue=""):
+	"""Huffman-compress data, building a tree for it unless one is given
+
+	To get back exactly what huffman_decode() was given, pass the tree and
+	residue it found (see its details parameter).
+	"""
+	if not data: return data # Probably wrong but should never happen anyway
+	# First, build a Huffman tree by figuring out which bytes are most common.
+	head = tree or huffman_tree(data)
 	# We now should have a Huffman tree where every node is either a leaf
 	# (a single byte value) or a tuple of two nodes with approximately
 	# equal frequency. Next, we turn that tree into a bit sequence that
 	# decode_tree() can parse, and also (for convenience) flatten it into
 	# a lookup table mapping byte values to their bit sequences.
-	bits = {}
-	ret = []
+	bits = BitWriter()
+	codes = [None] * 256
 	def _flatten(node, seq):
 		if isinstance(node, tuple):
-			ret.append("0")
+			bits.put(0, 1)
 			_flatten(node[0], seq + "0")
 			_flatten(node[1], seq + "1")
 		else:
-			ret.append("1" + format(node, "08b"))
-			bits[node] = seq
+			bits.put(256 | node, 9) # A one bit, then the eight bits of the byte
+			codes[node] = seq
 	_flatten(head, "")
-	# Finally, the easy bit: turn every data byte into a bit sequence.
-	ret.extend(bits[char] for char in data)
-	ret = "".join(ret)
-	spare = len(ret) % 8
+	# Finally, the easy bit: turn every data byte into a bit sequence. It's
+	# faster to join up a block of codes as text and pack that in one go
+	# than to put() each code individually, and this still only ever has
+	# one block's worth of "0" and "1" characters around at a time.
+	for ofs in range(0, len(data), 4096):
+		block = "".join(map(codes.__getitem__, data[ofs:ofs+4096]))
+		if block: bits.put(int(block, 2), len(block))
+	spare = len(bits) % 8
 	if spare:
-		# Hack: Reuse the residue from the last decode. I *think* this is just
-		# junk bits that are ignored on load.
-		if args.verify and len(last_huffman_residue) == 8-spare: ret += last_huffman_residue
-		else: ret += "0" * (8-spare)
-	return int(ret, 2).to_bytes(len(ret)//8, "big")
+		# The residue from the original, if we're reproducing it. I *think* this
+		# is just junk bits that are ignored on load.
+		if len(residue) == 8-spare: bits.put(int(residue, 2), 8-spare)
+		else: bits.put(0, 8-spare)
+	return bits.getvalue()
+
+def huffman_reencode(data, orig, encoded):
+	"""Huffman-encode data, an edited version of orig, given what orig encoded to
+
+	Reuses the tree from the original encoding, and as much of the original
+	bitstream as covers the unchanged start of the data, so only the part
+	after the first change actually needs encoding. Since synthesizers mostly
+	change the inventory, which is near the end of the save, that's usually
+	most of it. The result decodes to the same thing as huffman_encode(data)
+	would give, but (with a stale tree) is probably slightly bigger.
+	"""
+	bits = BitReader(encoded)
+	head = decode_tree(bits)
+	treebits = bits.pos
+	codes = [None] * 256
+	def _flatten(node, seq):
+		if isinstance(node, tuple):
+			_flatten(node[0], seq + "0")
+			_flatten(node[1], seq + "1")
+		else: codes[node] = seq
+	_flatten(head, "")
+	# Find out how much is unchanged. Binary search, so the comparisons are all done in C.
+	lo, hi = 0, min(len(data), len(orig))
+	while lo < hi:
+		mid = (lo + hi + 1) // 2
+		if data[:mid] == orig[:mid]: lo = mid
+		else: hi = mid - 1
+	tail = data[lo:]
+	# If the changes brought in any new byte values, the old tree can't represent them.
+	if any(codes[b] is None for b in set(tail)): return huffman_encode(data)
+	# Map each byte to the length of its code and add them all up, to find where
+	# the first change starts in the bitstream. (No Huffman code over 256 symbols
+	# can be more than 255 bits long, so the lengths fit in bytes.)
+	lengths = bytes(len(code) if code else 0 for code in codes)
+	prefix = treebits + sum(data[:lo].translate(lengths))
+	bits = BitWriter()
+	bits.put(int.from_bytes(encoded, "big") >> (len(encoded) * 8 - prefix), prefix)
+	for ofs in range(0, len(tail), 4096):
+		block = "".join(map(codes.__getitem__, tail[ofs:ofs+4096]))
+		if block: bits.put(int(block, 2), len(block))
+	spare = len(bits) % 8
+	if spare: bits.put(0, 8-spare)
+	return bits.getvalue()
 
 def get_varint(data):
 	"""Parse a protobuf varint out of the given data
@@ -958,9 +1676,44 @@ def protobuf_end_group(data):
 def protobuf_32bit(data):
 	return data.get(4)
 
+def protobuf_fields(data):
+	"""Iterate over the fields of a message, as (start, end, idx, wiretype, val)
+
+	Equivalent to repeatedly reading a varint key then protobuf_decoder[wiretype]
+	from a Consumable, but tracking a position in the bytes instead, which is a
+	lot quicker. The start and end give the span of the whole field, key included.
+	"""
+	pos, end = 0, len(data)
+	while pos < end:
+		start = pos
+		key = shift = 0
+		byte = 128
+		while byte > 127:
+			byte = data[pos]
+			key |= (byte&127) << shift
+			shift += 7
+			pos += 1
+		wiretype = key & 7
+		if wiretype == 0 or wiretype == 2:
+			val = shift = 0
+			byte = 128
+			while byte > 127:
+				byte = data[pos]
+				val |= (byte&127) << shift
+				shift += 7
+				pos += 1
+			if wiretype == 2:
+				val, pos = data[pos:pos + val], pos + val
+		elif wiretype == 1: val, pos = data[pos:pos + 8], pos + 8
+		elif wiretype == 5: val, pos = data[pos:pos + 4], pos + 4
+		else: raise Exception("Unimplemented")
+		if pos > end: raise ValueError("Out of data!")
+		yield start, pos, key >> 3, wiretype, val
+
 int32, int64 = object(), object() # Pseudo-types. On decode they become normal integers.
 
 class ProtoBuf:
+	__slots__ = () # So subclasses can be slotted (most aren't, and get a __dict__ as usual)
 	# These can be packed into arrays.
 	PACKABLE = {int: get_varint, int32: protobuf_decoder[1], int64: protobuf_decoder[5]}
 
@@ -976,27 +1729,128 @@ class ProtoBuf:
 		if typ in (list, dict): return val # TODO
 		raise ValueError("Unrecognized annotation %r in %s: data %r" % (typ, where, val[:64]))
 	@classmethod
-	def decode_protobuf(cls, data):
-		fields = list(cls.__dataclass_fields__)
-		data = Consumable(data)
-		values = {}
-		while data:
-			idx, wiretype = divmod(get_varint(data), 8)
-			field = fields[idx - 1]
-			val = protobuf_decoder[wiretype](data)
-			typ = cls.__dataclass_fields__[field].type
+	def codec(cls):
+		"""Compile this message type's fields into decoder and encoder dispatch tables
+
+		Done once per class, so that decoding and encoding don't have to keep
+		looking at the annotations. The decoders are indexed by field number, and
+		each one takes (values, wiretype, val) and puts the result into values;
+		the encoders are in field order, as (field, encoder) pairs, and each takes
+		(data, val) and appends the wire format to data.
+		"""
+		if "_codec" in cls.__dict__: return cls._codec
+		decoders = [None]
+		encoders = []
+		for idx, (field, info) in enumerate(cls.__dataclass_fields__.items()):
+			where = cls.__name__ + "." + field
+			typ = info.type
 			if isinstance(typ, list):
-				lst = values.setdefault(field, [])
-				if typ[0] in cls.PACKABLE and wiretype == 2:
-					# Packed integers.
-					val = Consumable(val)
-					while val:
-						lst.append(cls.PACKABLE[typ[0]](val))
+				elem = cls.compile_decoder(typ[0], where)
+				if typ[0] in cls.PACKABLE:
+					def decode(values, wiretype, val, field=field, elem=elem, packed=cls.PACKABLE[typ[0]]):
+						lst = values.setdefault(field, [])
+						if wiretype == 2:
+							# Packed integers.
+							val = Consumable(val)
+							while val:
+								lst.append(packed(val))
+						else: lst.append(val if wiretype == 0 else elem(val))
 				else:
-					lst.append(cls.decode_value(val, typ[0], cls.__name__ + "." + field))
+					def decode(values, wiretype, val, field=field, elem=elem):
+						values.setdefault(field, []).append(val if wiretype == 0 else elem(val))
+			else:
+				conv = cls.compile_decoder(typ, where)
+				def decode(values, wiretype, val, field=field, conv=conv):
+					values[field] = val if wiretype == 0 else conv(val)
+			decoders.append(decode)
+
+			tag = build_varint(idx * 8 + 10) # Length-delimited
+			if typ is int:
+				# Wiretype 0 integer
+				def encode(data, val, tag=build_varint(idx * 8 + 8)):
+					data.append(tag)
+					data.append(build_varint(val))
+			elif isinstance(typ, list) and typ[0] is not int:
+				elem = cls.compile_encoder(typ[0], where + "[*]")
+				def encode(data, val, tag=tag, elem=elem):
+					for val in val:
+						val = elem(val)
+						data.append(tag)
+						data.append(build_varint(len(val)))
+						data.append(val)
 			else:
-				values[field] = cls.decode_value(val, typ, cls.__name__ + "." + field)
-		return cls(**values)
+				conv = cls.compile_encoder(typ, where)
+				def encode(data, val, tag=tag, conv=conv):
+					val = conv(val)
+					data.append(tag)
+					data.append(build_varint(len(val)))
+					data.append(val)
+			encoders.append((field, encode))
+		cls._codec = decoders, encoders
+		return cls._codec
+	@staticmethod
+	def compile_decoder(typ, where):
+		"""Specialize decode_value() for one annotation, for non-varint data"""
+		if isinstance(typ, type) and issubclass(typ, ProtoBuf): return typ.decode_protobuf
+		if typ in (int32, int64): return lambda val: int.from_bytes(val, "little")
+		if typ in (bytes, list, dict): return lambda val: val
+		if typ is str: return lambda val: val.decode("UTF-8")
+		return lambda val: ProtoBuf.decode_value(val, typ, where)
+	@staticmethod
+	def compile_encoder(typ, where):
+		"""Specialize encode_value() for one annotation, for the values it's expected to have
+
+		Anything else (eg bytes where a submessage would be) goes the long way around.
+		"""
+		generic = lambda val: ProtoBuf.encode_value(val, typ, where)
+		if isinstance(typ, type) and issubclass(typ, ProtoBuf):
+			return lambda val: val.encode_protobuf() if isinstance(val, ProtoBuf) else generic(val)
+		if typ is str: return lambda val: val.encode("UTF-8") if isinstance(val, str) else generic(val)
+		if typ is bytes: return lambda val: val if isinstance(val, bytes) else generic(val)
+		return generic
+	@classmethod
+	def decode_protobuf(cls, data, lazy=False):
+		"""Decode a message of this type
+
+		If lazy, only plain (non-repeated) integers get decoded up front. Everything
+		else just has its byte span(s) noted, gets decoded on first access (see
+		LazyField), and if never accessed, gets re-encoded as the original bytes.
+		"""
+		decoders = cls.codec()[0]
+		values = {}
+		if not lazy or "__slots__" in cls.__dict__:
+			for start, end, idx, wiretype, val in protobuf_fields(data):
+				decoders[idx](values, wiretype, val)
+			return cls(**values)
+		fields = list(cls.__dataclass_fields__)
+		if "_lazy" not in cls.__dict__:
+			for field in fields: setattr(cls, field, LazyField(field))
+			# Repeated fields can have varint entries mixed in with the rest, so
+			# they're always left pending in full; otherwise encode_protobuf would
+			# see (and emit) only the part that was decoded.
+			cls._lazy = {field for field, info in cls.__dataclass_fields__.items() if isinstance(info.type, list)}
+		spans = {}
+		for start, end, idx, wiretype, val in protobuf_fields(data):
+			if wiretype or fields[idx - 1] in cls._lazy: spans.setdefault(fields[idx - 1], []).append((start, end))
+			else: decoders[idx](values, wiretype, val)
+		self = cls.__new__(cls)
+		for field, info in cls.__dataclass_fields__.items():
+			if field in values: self.__dict__[field] = values[field]
+			elif field in spans: pass
+			elif info.default is not dataclasses.MISSING: self.__dict__[field] = info.default
+			else: raise TypeError("%s missing required field %r" % (cls.__name__, field))
+		self.__dict__["_data"] = data
+		self.__dict__["_pending"] = spans
+		return self
+	def decode_pending(self, field):
+		"""Decode a field that was skipped by a lazy decode_protobuf()"""
+		decoders = self.codec()[0]
+		values = {}
+		for start, end in self._pending.pop(field):
+			for _, _, idx, wiretype, val in protobuf_fields(self._data[start:end]):
+				decoders[idx](values, wiretype, val)
+		if not self._pending: del self._data # Everything's decoded, no need to hang onto the original
+		return values[field]
 
 	@staticmethod
 	def encode_value(val, typ, where):
@@ -1014,31 +1868,34 @@ class ProtoBuf:
 		raise ValueError("Unrecognized annotation %r in %s: data %r" % (typ, where, val))
 	def encode_protobuf(self):
 		data = []
-		for idx, field in enumerate(self.__dataclass_fields__):
+		pending = getattr(self, "__dict__", { }).get("_pending") # (Slotted classes are never lazy)
+		for field, encode in self.codec()[1]:
+			if pending and field in pending and field not in self.__dict__:
+				# Never looked at, so it can't have changed - emit it exactly as it came in.
+				data.extend(self._data[start:end] for start, end in pending[field])
+				continue
 			val = getattr(self, field)
 			if not val and val != 0: continue # Skip empties, except that a 0 int should still get encoded
-			typ = self.__dataclass_fields__[field].type
-			if typ is int:
-				# Wiretype 0 integer
-				data.append(build_varint(idx * 8 + 8))
-				data.append(build_varint(val))
-				continue
-			if isinstance(typ, list) and typ[0] is not int:
-				typ = typ[0]
-				for val in val:
-					val = self.encode_value(val, typ, self.__class__.__name__ + "." + field + "[*]")
-					assert isinstance(val, bytes)
-					data.append(build_varint(idx * 8 + 10))
-					data.append(build_varint(len(val)))
-					data.append(val)
-				continue
-			val = self.encode_value(val, typ, self.__class__.__name__ + "." + field)
-			assert isinstance(val, bytes)
-			data.append(build_varint(idx * 8 + 10))
-			data.append(build_varint(len(val)))
-			data.append(val)
+			encode(data, val)
 		return b"".join(data)
 
+class LazyField:
+	"""Stand-in for a dataclass field of a lazily-decoded ProtoBuf
+
+	Once the field has been decoded (or assigned to), its value lives in the
+	instance dict, and this no longer gets a look-in.
+	"""
+	def __init__(self, name): self.name = name
+	def __get__(self, obj, cls):
+		if obj is not None and self.name in obj.__dict__.get("_pending", ()):
+			val = obj.__dict__[self.name] = obj.decode_pending(self.name)
+			return val
+		# Class-level access (or a field that was never present), look up the
+		# default the way the dataclass would.
+		default = cls.__dataclass_fields__[self.name].default
+		if default is dataclasses.MISSING: raise AttributeError(self.name)
+		return default
+
 # Stub types that are used by SaveFile
 SkillData = ResourceData = ItemData = Weapon = MissionPlaythrough = bytes
 DLCData = RegionGameStage = WorldDiscovery = WeaponMemento = ItemMemento = bytes
@@ -1064,7 +1921,7 @@ class InventorySlots(ProtoBuf):
 	weapons: int
 	num_quick_slots_flourished: int # No idea what this is.
 
-@dataclass
+@dataclass(**SLOTS)
 class BankSlot(ProtoBuf):
 	serial: bytes
 	# Yes, that's all there is. Just a serial number. Packaged up in a protobuf.
@@ -1073,7 +1930,7 @@ class BankSlot(ProtoBuf):
 	def is_equipped(self): return False
 	def is_carried(self): return False
 
-@dataclass
+@dataclass(**SLOTS)
 class PackedItemData(ProtoBuf):
 	serial: bytes
 	quantity: int
@@ -1084,7 +1941,7 @@ class PackedItemData(ProtoBuf):
 	def is_equipped(self): return self.equipped
 	def is_carried(self): return True
 
-@dataclass
+@dataclass(**SLOTS)
 class PackedWeaponData(ProtoBuf):
 	serial: bytes
 	quickslot: int
@@ -1166,39 +2023,71 @@ class SaveFile(ProtoBuf):
 	overpower_levels: int = None
 	last_overpower_choice: int = None
 
-	def add_inventory(self, asset):
-		if asset.is_weapon:
-			packed = PackedWeaponData(serial=asset.encode_asset_library(), quickslot=0, mark=1, unknown4=0)
-			self.packed_weapon_data.append(packed)
-		else:
-			packed = PackedItemData(serial=asset.encode_asset_library(), quantity=1, equipped=0, mark=1)
-			self.packed_item_data.append(packed)
+	def add_inventory(self, *assets, packed=None):
+		for asset, serial in zip(assets, Asset.encode_asset_libraries(assets, packed)):
+			if asset.is_weapon:
+				packed = PackedWeaponData(serial=serial, quickslot=0, mark=1, unknown4=0)
+				self.packed_weapon_data.append(packed)
+			else:
+				packed = PackedItemData(serial=serial, quantity=1, equipped=0, mark=1)
+				self.packed_item_data.append(packed)
 
 class SaveFileFormatError(Exception): pass
 
-def parse_savefile(fn):
-	with open(fn, "rb") as f: data = Consumable(f.read())
+# Bigger saves get compressed in blocks of this size (uncompressed). After the
+# total uncompressed size comes a block count, then a (compressed size,
+# uncompressed size) pair for each block, then the blocks themselves. All
+# big-endian, as per Gibbed.
+LZO_BLOCK_SIZE = 0x40000
+
+def decompress_savefile(data):
+	"""Decompress the body of a save file, given a Consumable positioned just after the hash"""
+	uncompressed_size = int.from_bytes(data.get(4), "big")
+	if uncompressed_size <= LZO_BLOCK_SIZE:
+		raw = lzo.decompress(data.peek(), False, uncompressed_size)
+		if len(raw) != uncompressed_size:
+			raise SaveFileFormatError("Got wrong amount of data back (%d != %d)" % (len(raw), uncompressed_size))
+		return raw
+	blocks = [(data.int(4, "big"), data.int(4, "big")) for _ in range(data.int(4, "big"))]
+	# Decompress each block straight into its place in the output. Note that
+	# python-lzo only accepts actual bytes (not memoryview or bytearray), so
+	# each block's compressed data does have to be sliced out.
+	raw = bytearray(uncompressed_size)
+	src = data.peek()
+	srcpos = dstpos = 0
+	for compsize, size in blocks:
+		size = min(size, uncompressed_size - dstpos)
+		block = lzo.decompress(src[srcpos:srcpos + compsize], False, size)
+		if len(block) != size:
+			raise SaveFileFormatError("Got wrong amount of data back in block at %d (%d != %d)" % (dstpos, len(block), size))
+		raw[dstpos:dstpos + size] = block
+		srcpos += compsize; dstpos += size
+	if dstpos != uncompressed_size:
+		raise SaveFileFormatError("Got wrong amount of data back (%d != %d)" % (dstpos, uncompressed_size))
+	return bytes(raw)
+
+def compress_savefile(raw):
+	"""Compress save data, giving the body of a save file (everything after the hash)"""
+	if len(raw) <= LZO_BLOCK_SIZE:
+		return len(raw).to_bytes(4, "big") + lzo.compress(bytes(raw), 1, False)
+	blocks = [lzo.compress(bytes(raw[ofs:ofs + LZO_BLOCK_SIZE]), 1, False) for ofs in range(0, len(raw), LZO_BLOCK_SIZE)]
+	return b"".join([
+		len(raw).to_bytes(4, "big"),
+		len(blocks).to_bytes(4, "big"),
+		*(len(block).to_bytes(4, "big") + min(LZO_BLOCK_SIZE, len(raw) - i * LZO_BLOCK_SIZE).to_bytes(4, "big")
+			for i, block in enumerate(blocks)),
+		*blocks,
+	])
+
+def unwrap_savefile(raw, details=None):
+	"""Unwrap the WSG container from decompressed save data, giving the protobuf payload
+
+	The details, if given, are passed along to huffman_decode().
+	"""
 	# PC builds, presumably including Linux builds, should be
 	# little-endian and LZO-compressed. Some retrievals are
 	# forced big-endian, others vary by platform. Dunno why.
 	endian = "little"
-	hash = data.get(20)
-	if hash != hashlib.sha1(data.peek()).digest():
-		raise SaveFileFormatError("Hash fails to validate")
-	uncompressed_size = int.from_bytes(data.get(4), "big")
-	if uncompressed_size > 0x40000:
-		raise SaveFileFormatError("TODO: handle chunked decompression")
-	raw = lzo.decompress(data.peek(), False, uncompressed_size)
-	if len(raw) != uncompressed_size:
-		raise SaveFileFormatError("Got wrong amount of data back (%d != %d)" % (len(raw), uncompressed_size))
-	if args.verify:
-		# LZO compression isn't stable or consistent enough to compare the
-		# compressed bytes to what we got from the file. But let's just
-		# quickly make sure we can get something back, at least.
-		comp = lzo.compress(raw, 1, False)
-		if lzo.decompress(comp, False, uncompressed_size) != raw:
-			print("Recompression gives something that we didn't get first time!")
-			return ""
 	# Okay. Decompression complete. Now to parse the actual data.
 	data = Consumable(raw)
 	size = int.from_bytes(data.get(4), "big")
@@ -1216,162 +2105,803 @@ def parse_savefile(fn):
 	# finishes off the current byte, and then there are always four more bytes.
 	if data.peek()[-4:] != b"\xd4\x93\x9f\x1a":
 		raise SaveFileFormatError("Different last four bytes: %r" % data.peek()[-4:])
-	data = huffman_decode(data.peek()[:-4], uncomp_size)
+	data = huffman_decode(data.peek()[:-4], uncomp_size, details)
 	if crc != binascii.crc32(data):
 		raise SaveFileFormatError("CRC doesn't match (%d vs %d)" % (crc, binascii.crc32(data)))
-	if args.verify:
-		reconstructed = huffman_encode(data)
-		reconstructed = b"".join([
-			(3 + 4 + 4 + 4 + len(reconstructed) + 4).to_bytes(4, "big"),
-			b"WSG",
-			(2).to_bytes(4, endian),
-			binascii.crc32(data).to_bytes(4, endian),
-			len(data).to_bytes(4, endian),
-			reconstructed,
-			b"\xd4\x93\x9f\x1a",
-		])
-		if reconstructed != raw:
-			if len(reconstructed) != len(raw):
-				print("Imperfect recompression:", len(raw), len(reconstructed))
-				return ""
-			print("Mismatched after recompression", len(raw))
-			for ofs in range(0, len(raw), 64):
-				old = raw[ofs:ofs+64]
-				new = reconstructed[ofs:ofs+64]
-				if old != new:
-					print(ofs, old)
-					print(ofs, new)
-			return ""
-	savefile = SaveFile.decode_protobuf(data)
-	if args.verify:
-		reconstructed = savefile.encode_protobuf()
-		if reconstructed != data:
-			print("Imperfect reconstruction:", len(data))
-			for sz in range(64, max(len(data), len(reconstructed))+65, 64):
-				if data[:sz] == reconstructed[:sz]: continue
-				print(sz-64)
-				print(data[sz-64:sz])
-				print(reconstructed[sz-64:sz])
-				break
-			return ""
+	return data
+
+def wrap_savefile(encoded, data):
+	"""Counterpart to unwrap_savefile: wrap up the Huffman encoding of data in a WSG container"""
+	endian = "little"
+	return b"".join([
+		(3 + 4 + 4 + 4 + len(encoded) + 4).to_bytes(4, "big"),
+		b"WSG",
+		(2).to_bytes(4, endian),
+		binascii.crc32(data).to_bytes(4, endian),
+		len(data).to_bytes(4, endian),
+		encoded,
+		b"\xd4\x93\x9f\x1a",
+	])
+
+def seal_savefile(raw):
+	"""Compress and checksum WSG data, giving the full contents of a .sav file"""
+	comp = compress_savefile(raw)
+	return hashlib.sha1(comp).digest() + comp
+
+def encode_savefile(savefile):
+	"""Encode a SaveFile from scratch, the whole way through to what goes on disk"""
+	data = savefile.encode_protobuf()
+	return seal_savefile(wrap_savefile(huffman_encode(data), data))
+
+def read_savefile(fn):
+	"""Read and decode a save file, without any of parse_savefile's extras
+
+	Returns the SHA1 from its header, and the (lazily-decoded) SaveFile.
+	"""
+	with open(fn, "rb") as f: data = Consumable(f.read())
+	hash = data.get(20)
+	if hash != hashlib.sha1(data.peek()).digest():
+		raise SaveFileFormatError("Hash fails to validate")
+	return hash, SaveFile.decode_protobuf(unwrap_savefile(decompress_savefile(data)), lazy=True)
+
+# Scans are kept in memory as well, by save file path, so --serve never needs to reload them.
+# Like the serial decode cache, the least recently used get dropped past this many.
+RESIDENT_SCANS = 256
+resident_scans = collections.OrderedDict()
+
+def store_scan(key, scan, persist=True):
+	"""Keep a scan in memory, and (unless it's already there) in the asset cache"""
+	if persist:
+		# Another --jobs worker might be writing at the same time. Not a big deal if we miss out.
+		try: store_derived({"Scan " + key: scan}, scan_sources())
+		except sqlite3.Error: pass
+	resident_scans[key] = scan
+	resident_scans.move_to_end(key)
+	while len(resident_scans) > RESIDENT_SCANS: resident_scans.popitem(last=False)
+
+def parse_savefile(fn):
+	with open(fn, "rb") as f: data = Consumable(f.read())
+	hash = data.get(20)
+	if hash != hashlib.sha1(data.peek()).digest():
+		raise SaveFileFormatError("Hash fails to validate")
+	# If we've seen this exact file before (with the same asset data), we already
+	# know what's in it. Synthesis needs the real thing though. Scans are stored
+	# by path, with the hash to say whether it's still the same file, so each
+	# save only ever has one (see also prune_scans). A scan has the fully decoded
+	# inventory if anything has needed all of it, and always has the raw slots,
+	# so other filters can still skip everything up to decoding the serials.
+	cacheable = args.synth is None
+	key = os.path.abspath(fn)
+	if cacheable:
+		scan = resident_scans.get(key)
+		if not scan or scan[0] != hash or (scan[2] is None and args.loot_filter is not None):
+			scan = get_derived("Scan " + key, scan_sources()) or scan
+		if scan and scan[0] == hash:
+			_, summary, inventory, slots = scan
+			full = False
+			if inventory is None and args.loot_filter is not None:
+				inventory = filter_inventory(slots)
+				# With no filters, that's everything, and worth keeping.
+				full = not args.loot_filter
+				if full: scan = hash, summary, inventory, slots
+			store_scan(key, scan, full)
+			return list_inventory(summary, inventory)
+	raw = decompress_savefile(data)
+	data = unwrap_savefile(raw)
+	savefile = SaveFile.decode_protobuf(data, lazy=True)
 	cls = get_asset("Player Classes")[savefile.playerclass]["class"]
+	summary = "Level %d (%dxp) %s: \x1b[1;31m%s\x1b[0m (%d+%d items)" % (savefile.level, savefile.exp, cls,
+		savefile.preferences.name, len(savefile.packed_weapon_data), len(savefile.packed_item_data) - 2)
 	# The packed_weapon_data and packed_item_data arrays contain the correct
 	# number of elements for the inventory items. (Equipped or backpack is
 	# irrelevant, but anything that isn't a weapon ('nade mod, class mod, etc)
 	# goes in the item data array.)
-	items = []
-	for item in (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or []):
-		if args.loot_filter is None: break
-		it = Asset.decode_asset_library(item.serial)
-		if not it: continue
-		for filter, filterargs in args.loot_filter:
-			if not filter(item, it, *filterargs): break
-		else:
-			items.append((item.order(), -it.grade, item.prefix() + repr(it)))
-	ret = "Level %d (%dxp) %s: \x1b[1;31m%s\x1b[0m (%d+%d items)" % (savefile.level, savefile.exp, cls,
-		savefile.preferences.name, len(savefile.packed_weapon_data), len(savefile.packed_item_data) - 2)
-	items.sort()
-	ret += "".join("\n" + desc for order, lvl, desc in items if order >= 0)
+	slots = (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])
+	inventory = None # Not decoded if we're not going to look at it
+	if args.loot_filter is not None: inventory = filter_inventory(slots)
+	if cacheable:
+		# If the filters threw things out, what's left is no good for any other
+		# filters, but they can still start from the slots next time.
+		store_scan(key, (hash, summary, None if args.loot_filter else inventory, slots))
+	ret = list_inventory(summary, inventory)
 	if args.synth is not None:
 		# Make changes to the save file before synthesizing
 		# savefile.preferences.name = "PATCHED" # Easy way to see what's happening
 		for synth, synthargs in args.synth: synth(savefile, *synthargs)
 
-		data = savefile.encode_protobuf()
-		reconstructed = huffman_encode(data)
-		reconstructed = b"".join([
-			(3 + 4 + 4 + 4 + len(reconstructed) + 4).to_bytes(4, "big"),
-			b"WSG",
-			(2).to_bytes(4, endian),
-			binascii.crc32(data).to_bytes(4, endian),
-			len(data).to_bytes(4, endian),
-			reconstructed,
-			b"\xd4\x93\x9f\x1a",
-		])
-		comp = len(reconstructed).to_bytes(4, "big") + lzo.compress(reconstructed, 1, False)
-		comp = hashlib.sha1(comp).digest() + comp
+		# Untouched fields get spliced in from the original bytes (see decode_protobuf),
+		# and so does the Huffman encoding of everything up to the first change.
+		payload, data = data, savefile.encode_protobuf()
+		reconstructed = seal_savefile(wrap_savefile(huffman_reencode(data, payload, raw[19:-4]), data))
 		# TODO: Have an option to move the original into the current directory, and then write to the original file name
-		with open("synthesized-%s.sav" % (args.file or ""), "wb") as f: f.write(comp)
+		with open("synthesized-%s.sav" % (args.file or ""), "wb") as f: f.write(reconstructed)
 	return ret
 
-def compare(id1, id2):
-	obj1, obj2 = [Asset.decode_asset_library(unarmor_serial(id)) for id in (id1, id2)]
-	if obj1.is_weapon != obj2.is_weapon:
-		print("Can only compare two weapons or two items, not one of each")
+def first_difference(old, new, blocksize=64):
+	"""Describe where two byte strings first differ, for verification failures"""
+	for ofs in range(0, max(len(old), len(new)), blocksize):
+		if old[ofs:ofs+blocksize] != new[ofs:ofs+blocksize]:
+			return "lengths %d/%d, first difference in block at %d:\n%r\n%r" % (len(old), len(new), ofs,
+				old[ofs:ofs+blocksize], new[ofs:ofs+blocksize])
+	return "no difference?"
+
+def verify_savefile(fn):
+	"""Check that a save file round-trips exactly through all of our encoders
+
+	This is what --verify does, instead of listing. Each layer gets decoded,
+	re-encoded and compared to the original; with --verify-sample N, only N
+	of the items (chosen at random) get checked, rather than all of them.
+	"""
+	with open(fn, "rb") as f: data = Consumable(f.read())
+	if data.get(20) != hashlib.sha1(data.peek()).digest():
+		raise SaveFileFormatError("Hash fails to validate")
+	raw = decompress_savefile(data)
+	# LZO compression isn't stable or consistent enough to compare the
+	# compressed bytes to what we got from the file. But let's just
+	# quickly make sure we can get something back, at least.
+	if decompress_savefile(Consumable(compress_savefile(raw))) != raw:
+		raise SaveFileFormatError("Recompression gives something that we didn't get first time!")
+	details = { }
+	payload = unwrap_savefile(raw, details)
+	# With the original tree and residue, the Huffman encoding should be bit-for-bit identical.
+	reconstructed = wrap_savefile(huffman_encode(payload, details["tree"], details["residue"]), payload)
+	if reconstructed != raw:
+		raise SaveFileFormatError("Mismatched after recompression: " + first_difference(raw, reconstructed))
+	savefile = SaveFile.decode_protobuf(payload)
+	reconstructed = savefile.encode_protobuf()
+	if reconstructed != payload:
+		raise SaveFileFormatError("Imperfect reconstruction: " + first_difference(payload, reconstructed))
+	serials = [item.serial for item in (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])]
+	total = len(serials)
+	if 0 < args.verify_sample < total: serials = random.sample(serials, args.verify_sample)
+	try: Asset.verify_serials(serials)
+	except AssertionError as e: raise SaveFileFormatError(str(e))
+	return "OK (LZO, Huffman, protobuf, %d/%d items)" % (len(serials), total)
+
+def scan_sources():
+	# Cached scans are only valid as long as the asset data they were decoded with
+	return [fn for fn in ASSET_FILES if os.path.exists(asset_path(fn))]
+
+def prune_scans():
+	"""Forget the cached scans of any save files that no longer exist"""
+	# Anything not keyed by a path is from before scans were, and can go too.
+	path, stamp = derived_stamp(scan_sources())
+	try:
+		db = asset_cache_db(path)
+		gone = [(name,) for name, in db.execute("select name from derived where name like 'Scan %'")
+			if not os.path.isabs(name[5:]) or not os.path.exists(name[5:])]
+		with db: db.executemany("delete from derived where name = ?", gone)
+	except sqlite3.Error: pass
+	for key in [key for key in resident_scans if not os.path.exists(key)]: del resident_scans[key]
+
+def filter_inventory(inventory):
+	"""Decode inventory slots into (slot, Asset) pairs, skipping those the loot filters would reject
+
+	If all the filters say what fields they need, everything gets decoded only
+	that far first, and anything rejected goes no further.
+	"""
+	fields = set()
+	for filter, filterargs in args.loot_filter:
+		if not hasattr(filter, "needs"):
+			fields = None
+			break
+		fields.update(filter.needs)
+	if args.loot_filter and fields is not None:
+		partial = Asset.decode_asset_libraries([item.serial for item in inventory], fields)
+		inventory = [item for item, it in zip(inventory, partial) if it and
+			all(filter(item, it, *filterargs) for filter, filterargs in args.loot_filter)]
+	return [(item, it) for item, it in zip(inventory, Asset.decode_asset_libraries([item.serial for item in inventory])) if it]
+
+def list_inventory(summary, inventory):
+	"""Format a save file's summary and the (slot, Asset) pairs that pass the loot filters"""
+	items = []
+	if args.loot_filter is None: inventory = None # Not showing loot, just the summary
+	for item, it in inventory or ():
+		for filter, filterargs in args.loot_filter:
+			if not filter(item, it, *filterargs): break
+		else:
+			items.append((item.order(), -it.grade, item.prefix() + repr(it)))
+	items.sort()
+	return summary + "".join("\n" + desc for order, lvl, desc in items if order >= 0)
+
+# Everything from every save that's been --query'd, across characters and games.
+INVENTORY_INDEX = os.path.expanduser(os.environ.get("BL2_INVENTORY_INDEX", "~/.cache/bl2_inventory.sqlite3"))
+INVENTORY_INDEX_VERSION = 1
+INVENTORY_INDEX_TABLES = {
+	"saves": "path text primary key, dir text, game text, mtime real, size integer, hash blob, character text, class text, level integer",
+	"items": """path text, game text, character text, location text, slot text, is_weapon integer,
+		balance text, type text, brand text, title text, pfx text, grade integer, stage integer,
+		pieces text, material text, serial text, description text""",
+}
+def inventory_index(conn={}):
+	if os.getpid() not in conn:
+		os.makedirs(os.path.dirname(INVENTORY_INDEX), exist_ok=True)
+		db = conn[os.getpid()] = sqlite3.connect(INVENTORY_INDEX)
+		if db.execute("pragma user_version").fetchone()[0] != INVENTORY_INDEX_VERSION:
+			for table in INVENTORY_INDEX_TABLES: db.execute("drop table if exists " + table)
+			db.execute("pragma user_version = %d" % INVENTORY_INDEX_VERSION)
+		for table, columns in INVENTORY_INDEX_TABLES.items():
+			db.execute("create table if not exists %s (%s)" % (table, columns))
+		db.execute("create index if not exists items_path on items (path)")
+		db.execute("create index if not exists items_grade on items (grade)")
+		db.commit()
+	return conn[os.getpid()]
+
+def update_index(dir):
+	"""Bring the inventory index up to date with the save files in one directory
+
+	Only the saves that have changed since they were last indexed get decoded.
+	"""
+	db = inventory_index()
+	known = {path: (mtime, size, hash) for path, mtime, size, hash in
+		db.execute("select path, mtime, size, hash from saves where dir = ?", (dir,))}
+	for fn in sorted(os.listdir(dir)):
+		if not fn.endswith(".sav"): continue
+		path = os.path.join(dir, fn)
+		st = os.stat(path)
+		mtime, size, oldhash = known.pop(path, (None, None, None))
+		if (mtime, size) == (st.st_mtime, st.st_size): continue
+		try: hash, savefile = read_savefile(path)
+		except SaveFileFormatError as e:
+			print(fn, e.args[0])
+			continue
+		if hash == oldhash:
+			# Touched but not changed
+			with db: db.execute("update saves set mtime = ?, size = ? where path = ?", (st.st_mtime, st.st_size, path))
+			continue
+		character = savefile.preferences.name
+		cls = get_asset("Player Classes")[savefile.playerclass]["class"]
+		inventory = (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])
+		rows = []
+		for usage, it in zip(inventory, Asset.decode_asset_libraries([usage.serial for usage in inventory])):
+			if not it: continue
+			location = "bank" if isinstance(usage, BankSlot) else "equipped" if usage.is_equipped() else "backpack"
+			rows.append((path, GAME, character, location, usage.prefix(), it.is_weapon,
+				it.balance, it.type, it.brand, it.get_title(), it.pfx, it.grade, it.stage,
+				" + ".join(filter(None, it.pieces)), it.material, armor_serial(usage.serial), it.summary()))
+		with db:
+			db.execute("delete from items where path = ?", (path,))
+			if rows: db.executemany("insert into items values (%s)" % ",".join("?" * len(rows[0])), rows)
+			db.execute("insert or replace into saves values (?, ?, ?, ?, ?, ?, ?, ?, ?)", (path, dir, GAME,
+				st.st_mtime, st.st_size, hash, character, cls, savefile.level))
+	# Anything left in known has been deleted (or renamed).
+	with db:
+		for path in known:
+			db.execute("delete from items where path = ?", (path,))
+			db.execute("delete from saves where path = ?", (path,))
+
+def run_query(terms):
+	"""Search the inventory index, eg --query level:70 brand:Maliwan type:SMG bank"""
+	conds, params = ["1"], []
+	for func, funcargs in terms:
+		cond, condparams = func(*funcargs)
+		conds.append(cond)
+		params.extend(condparams)
+	start = time.perf_counter()
+	rows = inventory_index().execute("""select game, character, slot, description, serial, pieces from items
+		where %s order by game, character, location = 'bank', grade desc, description""" % " and ".join(conds), params).fetchall()
+	tm = time.perf_counter() - start
+	for game, character, slot, desc, serial, pieces in rows:
+		line = "%s [%s]: %s%s" % (character, "TPS" if game == "borderlands the pre-sequel" else "BL2", slot, desc)
+		if args.itemids: line += " {%s}" % serial
+		if args.pieces: line += "\n" + pieces
+		print(line)
+	print("%d item(s) in %.3fms" % (len(rows), tm * 1000))
+
+def library_ids(sources):
+	"""Find all the item IDs in the given --library arguments, one at a time
+
+	Each source is "input" (or "-") to read stdin, the name of a file to read,
+	or a comma-separated list of IDs. Anything that looks like an ID counts, so
+	lines like 'BL2(...)' or '"ID": "name",' are fine, as are bare IDs.
+	"""
+	def scan(lines):
+		for line in lines:
+			if '{' in line: line = line.split("{")[1].split("}")[0]
+			for id in line.split("#")[0].replace('"', " ").replace("(", " ").replace(")", " ").split():
+				# Serials are longer than anything else likely to be on the line
+				if len(id) >= 20: yield id
+	for source in sources:
+		if source in ("input", "-"): yield from scan(sys.stdin)
+		elif os.path.isfile(source):
+			with open(source, encoding="utf-8") as f: yield from scan(f)
+		else: yield from scan(source.split(","))
+
+def import_library(sources):
+	"""Add items to the library file, skipping any that are already there
+
+	IDs get normalized (seed, grade and stage of 50) so variants of the same
+	item collapse to one entry. Everything streams, so importing a huge list
+	is fine; the only thing held in memory is the set of known IDs.
+	"""
+	known = load_library()
+	added = dups = bad = 0
+	ids = library_ids(sources)
+	os.makedirs(os.path.dirname(os.path.abspath(LIBRARY_FILE)), exist_ok=True)
+	with open(LIBRARY_FILE, "a", encoding="utf-8") as out:
+		while "more to import":
+			batch = []
+			for id in itertools.islice(ids, LIBRARY_BATCH):
+				try: batch.append(unarmor_serial(id))
+				except (binascii.Error, ValueError): bad += 1
+			if not batch: break
+			try: decoded = Asset.decode_asset_libraries(batch)
+			except (ValueError, LookupError):
+				# Something in here is bad. Go through them one at a time to find out what.
+				decoded = []
+				for serial in batch:
+					try: decoded.append(Asset.decode_asset_library(serial))
+					except (ValueError, LookupError): decoded.append(None)
+			objs = []
+			for obj in decoded:
+				if not obj:
+					bad += 1
+					continue
+				obj.grade = obj.stage = obj.seed = 50
+				objs.append(obj)
+			for obj, serial in zip(objs, Asset.encode_asset_libraries(objs)):
+				id = armor_serial(serial)
+				if id in known:
+					dups += 1
+					continue
+				known[id] = obj.get_title()
+				print("%s\t%s\t%s" % (GAME, id, known[id]), file=out)
+				print(id, known[id])
+				added += 1
+			out.flush()
+	print("Added %d, %d already in the library, %d not valid" % (added, dups, bad))
+
+def compare(*ids):
+	"""Show a matrix of which parts each of the given items has, and could have
+
+	Items can be given by ID, or by name if they're in the library.
+	"""
+	names = {name: id for id, name in load_library().items()}
+	objs = []
+	for id in ids:
+		try: objs.append(Asset.decode_asset_library(unarmor_serial(names.get(id, id))))
+		except (binascii.Error, ValueError, LookupError):
+			print("Unable to decode %r" % id)
+			return
+	if len({obj.is_weapon for obj in objs}) > 1:
+		print("Can only compare weapons with weapons or items with items, not a mix")
 		return
 	# Show the available options and which one is in each object
-	# This is most often going to be used for comparing two items of the same
-	# type/balance, so their piece options will be the same. But it can also
-	# be used to compare two different ones, and see which part options change.
+	# This is most often going to be used for comparing items of the same
+	# type/balance, so their piece options will be the same (and only get
+	# figured out once). But it can also be used to compare different ones,
+	# and see which part options change.
 	# For each object, see if the part is Selected, Available, or Unavailable
 	# (Note that None counts as a part.)
-	colors = {
-		"SS": "1", "AA": "0",
-		"SA": "1;34", "AS": "1;32",
-		"AU": "34", "UA": "32",
-		"SU": "1;4;34", "US": "1;4;32",
-	}
-	print("\x1b[%sm%r\x1b[0m" % (colors["SA"], obj1))
-	pieces1 = get_piece_options(obj1)
-	print("\x1b[%sm%r\x1b[0m" % (colors["AS"], obj2))
-	pieces2 = get_piece_options(obj2)
-	for i, (n, opts1, opts2) in enumerate(zip(obj1.partnames, pieces1, pieces2)):
-		seen = {}
-		for p in opts1 + opts2 + [None]:
-			if p in seen: continue # Deduplicate but keep order
-			seen[p] = 1
-			s1 = "A" if p in opts1 else "U"
-			s2 = "A" if p in opts2 else "U"
-			p1 = obj1.pieces[i]; p2 = obj2.pieces[i]
-			if (p is None and not p1) or (p and p1 and p.endswith(p1)): s1 = "S"
-			if (p is None and not p2) or (p and p2 and p.endswith(p2)): s2 = "S"
-			state = s1 + s2
-			if state == "UU": continue # Not available on either (probably "None"). Ignore it.
-			print("%s \x1b[%sm%s\x1b[0m" % (n, colors[state], p))
-			n = " " * len(n)
-
-if args.compare:
-	compare(*args.compare)
-	sys.exit()
-if args.platform == "native":
-	dir = os.path.expanduser("~/.local/share/aspyr-media/" + GAME + "/willowgame/savedata")
-else:
+	cells = {"S": "\x1b[1;32mS\x1b[0m", "A": "A", "U": "\x1b[2m.\x1b[0m"}
+	for n, obj in enumerate(objs, 1): print("%2d: %r" % (n, obj))
+	options = [get_piece_options(obj) for obj in objs]
+	width = max(len(n) for n in objs[0].partnames)
+	print(" " * width, *("%2d" % n for n in range(1, len(objs) + 1)))
+	for i, n in enumerate(objs[0].partnames):
+		opts = [o[i] for o in options]
+		for p in dict.fromkeys(itertools.chain(*opts, [None])): # Deduplicate but keep order
+			states = []
+			for obj, o in zip(objs, opts):
+				piece = obj.pieces[i]
+				if (p is None and not piece) or (p and piece and p.endswith(piece)): states.append("S")
+				else: states.append("A" if p in o else "U")
+			if set(states) == {"U"}: continue # Not available on any (probably "None"). Ignore it.
+			print(n.ljust(width), *(" " + cells[s] for s in states), p)
+			n = ""
+
+def process_savefile(fn):
+	"""Do whatever we've been asked to do to one save file, printing the result
+
+	Returns False if it failed (which, when verifying, is what we're looking for).
+	"""
+	func = verify_savefile if args.verify else benchmark if args.benchmark else parse_savefile
+	try: print(func(fn))
+	except SaveFileFormatError as e:
+		print(e.args[0])
+		return False
+	return True
+
+def scan_savefile(fn):
+	"""Process one save file in a --jobs worker
+
+	Returns everything it would have printed, how long it took, and whether it
+	succeeded, so the parent can show the files in order.
+	"""
+	start = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()) as out:
+		ok = process_savefile(fn)
+	return out.getvalue(), time.perf_counter() - start, ok
+
+def synthetic_savefile(weapons=20, items=20, bank=100, seed=0):
+	"""Make up a plausible-looking SaveFile, for benchmarking
+
+	The weapons and items are random (but valid) ones, from random balances,
+	with random parts; the opaque blobs are random bytes, mostly small, in
+	something like the sizes a real mid-game character has. The same seed
+	always gives the same save.
+	"""
+	rng = random.Random(seed)
+	balances = sorted(get_asset("Weapon Balance")), sorted(get_asset("Item Balance"))
+	def blob(size): return bytes(rng.choices(range(256), [64] * 4 + [1] * 252, k=size))
+	def random_asset(is_weapon):
+		while "not got one":
+			try: obj = item(rng.randrange(1, 81), rng.choice(balances[is_weapon]))
+			except (KeyError, IndexError, TypeError): continue # Not all balances can be made into things
+			obj.seed = rng.randrange(1<<31)
+			obj.pieces = [piece and strip_prefix(piece) for piece in map(rng.choice, get_piece_options(obj))]
+			try: obj._pack()
+			except KeyError: continue # Some listed parts aren't in the asset library, so can't be encoded
+			return obj
+	savefile = SaveFile(playerclass="GD_Siren_Streaming.Character.CharClass_Siren", level=50, exp=1234567,
+		general_skill_points=0, specialist_skill_points=0, money=[12345678, 250, 10, 0, 50], playthroughs_completed=1,
+		skills=[blob(60) for _ in range(40)], stats=blob(2500), missions=[blob(1500) for _ in range(3)],
+		preferences=UIPreferences(name="Benchmark", color1=Color(255, 1, 2, 3), color2=Color(255, 4, 5, 6), color3=Color(255, 7, 8, 9)),
+		inventory_slots=InventorySlots(backpack=39, weapons=4, num_quick_slots_flourished=0),
+		challenges=[blob(20) for _ in range(300)], world_discovery=[blob(30) for _ in range(100)],
+		last_save_date="20201231235959", packed_weapon_data=[], packed_item_data=[], bank=[], max_bank_slots=bank)
+	savefile.add_inventory(*(random_asset(1) for _ in range(weapons)))
+	for slot, weap in enumerate(savefile.packed_weapon_data[:4], 1): weap.quickslot = slot
+	savefile.add_inventory(*(random_asset(0) for _ in range(items)))
+	banked = [random_asset(rng.randrange(2)) for _ in range(bank)]
+	savefile.bank = [BankSlot(serial=serial) for serial in Asset.encode_asset_libraries(banked)]
+	return savefile
+
+def benchmark_savefile(data, repeat=5):
+	"""Time the individual stages of decoding (and re-encoding) a save file
+
+	Returns (description, seconds) pairs, best of repeat runs each.
+	"""
+	timings = []
+	def stage(desc, func, *a):
+		best = None
+		for _ in range(repeat):
+			start = time.perf_counter()
+			ret = func(*a)
+			tm = time.perf_counter() - start
+			if best is None or tm < best: best = tm
+		timings.append((desc, best))
+		return ret
+	stage("SHA1", lambda: hashlib.sha1(data[20:]).digest())
+	raw = stage("LZO", lambda: decompress_savefile(Consumable(data[20:])))
+	# Most saves fit in one LZO block, so also try a synthetic one of a few blocks,
+	# as pad:N would give (though without the bother of a valid save around it).
+	big = (raw * (4 * LZO_BLOCK_SIZE // len(raw) + 1))[:4 * LZO_BLOCK_SIZE + 12345]
+	comp = stage("LZO compress (%dKB)" % (len(big) // 1024), compress_savefile, big)
+	stage("LZO chunked (%dKB)" % (len(big) // 1024), lambda: decompress_savefile(Consumable(comp)))
+	uncomp_size = int.from_bytes(raw[15:19], "little")
+	def legacy_huffman(data, size):
+		# The way it used to be done, with a string of "0" and "1" characters,
+		# kept here as a baseline for comparison.
+		bits = Consumable.from_bits(data)
+		def tree():
+			if bits.get(1) == "1": return int(bits.get(8), 2)
+			return (tree(), tree())
+		root = tree()
+		ret = []
+		while len(ret) < size:
+			cur = root
+			while isinstance(cur, tuple): cur = cur[bits.get(1) == "1"]
+			ret.append(cur)
+		return bytes(ret)
+	stage("Huffman (strings)", legacy_huffman, raw[19:-4], uncomp_size)
+	payload = stage("Huffman", huffman_decode, raw[19:-4], uncomp_size)
+	stage("CRC", binascii.crc32, payload)
+	stage("Protobuf (eager)", SaveFile.decode_protobuf, payload)
+	savefile = stage("Protobuf", SaveFile.decode_protobuf, payload, True)
+	if args.codec_rounds:
+		# The way the protobuf code used to work, looking at the annotations for
+		# every field of every message, kept here as a baseline for comparison.
+		def legacy_decode(cls, data):
+			fields = list(cls.__dataclass_fields__)
+			data = Consumable(data)
+			values = {}
+			while data:
+				idx, wiretype = divmod(get_varint(data), 8)
+				field = fields[idx - 1]
+				val = protobuf_decoder[wiretype](data)
+				typ = cls.__dataclass_fields__[field].type
+				if isinstance(typ, list):
+					lst = values.setdefault(field, [])
+					if typ[0] in cls.PACKABLE and wiretype == 2:
+						val = Consumable(val)
+						while val: lst.append(cls.PACKABLE[typ[0]](val))
+					elif isinstance(typ[0], type) and issubclass(typ[0], ProtoBuf) and not isinstance(val, int):
+						lst.append(legacy_decode(typ[0], val))
+					else: lst.append(cls.decode_value(val, typ[0], field))
+				elif isinstance(typ, type) and issubclass(typ, ProtoBuf) and not isinstance(val, int):
+					values[field] = legacy_decode(typ, val)
+				else: values[field] = cls.decode_value(val, typ, field)
+			return cls(**values)
+		def legacy_encode(self):
+			data = []
+			for idx, field in enumerate(self.__dataclass_fields__):
+				val = getattr(self, field)
+				if not val and val != 0: continue
+				typ = self.__dataclass_fields__[field].type
+				if typ is int:
+					data.append(build_varint(idx * 8 + 8))
+					data.append(build_varint(val))
+					continue
+				for val in (val if isinstance(typ, list) and typ[0] is not int else [val]):
+					val = legacy_encode(val) if isinstance(val, ProtoBuf) else self.encode_value(val, typ, field)
+					data.append(build_varint(idx * 8 + 10))
+					data.append(build_varint(len(val)))
+					data.append(val)
+			return b"".join(data)
+		def round_trips(decode, encode):
+			for _ in range(args.codec_rounds): encode(decode(payload))
+		# These are slow enough that best-of-N isn't needed (or wanted).
+		repeat, saved = 1, repeat
+		stage("Protobuf x%d (interpreted)" % args.codec_rounds, round_trips, functools.partial(legacy_decode, SaveFile), legacy_encode)
+		stage("Protobuf x%d (compiled)" % args.codec_rounds, round_trips, SaveFile.decode_protobuf, SaveFile.encode_protobuf)
+		repeat = saved
+	serials = [item.serial for item in (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])]
+	# The serial caches would make all but the first run free, so skip them (and then show them separately)
+	assets = stage("Assets (%d)" % len(serials), Asset._decode_batch, serials)
+	stage("Assets (cached)", Asset.decode_asset_libraries, serials)
+	stage("Repr", lambda: [repr(a) for a in assets if a])
+	# And back the other way, as --synth does it. (Sans the splicing, that is.)
+	assets = [a for a in assets if a]
+	stage("Assets encode", lambda: Asset.encode_asset_libraries(assets, [a._pack() for a in assets]))
+	stage("Assets encode (cached)", Asset.encode_asset_libraries, assets)
+	payload = stage("Protobuf encode", SaveFile.decode_protobuf(payload).encode_protobuf)
+	stage("CRC encode", binascii.crc32, payload)
+	encoded = stage("Huffman encode", huffman_encode, payload)
+	raw = stage("WSG wrap", wrap_savefile, encoded, payload)
+	comp = stage("LZO compress", compress_savefile, raw)
+	stage("SHA1 encode", lambda: hashlib.sha1(comp).digest())
+	return timings
+
+def benchmark(fn, repeat=5):
+	"""Time the individual stages of parse_savefile, best of repeat runs each"""
+	with open(fn, "rb") as f: data = f.read()
+	return "".join("\n%-24s %9.3fms" % (desc, tm * 1000) for desc, tm in benchmark_savefile(data, repeat))
+
+def benchmark_memory(dir):
+	"""Load every save in dir at once, with all their items decoded, and see what it costs
+
+	Reports both what got allocated for the saves and items themselves, and
+	the peak RSS of the whole process (Python, the assets, and all).
+	"""
+	get_asset_library_manager() # Load that first, so it doesn't count
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	tracemalloc.start()
+	loaded = []
+	items = 0
+	for fn in sorted(os.listdir(dir)):
+		if not fn.endswith(".sav"): continue
+		try: hash, savefile = read_savefile(os.path.join(dir, fn))
+		except SaveFileFormatError: continue
+		inventory = (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])
+		# Not via the decode cache, which would both cap and duplicate them
+		loaded.append((savefile, Asset._decode_batch([slot.serial for slot in inventory])))
+		items += len(inventory)
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return "%d saves, %d items: %.1fMB allocated (%.1fMB peak), about %d bytes per item\nPeak RSS %.1fMB (%.1fMB before loading)" % (
+		len(loaded), items, size / 1048576, peak / 1048576, size // (items or 1),
+		resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, rss / 1024)
+
+def benchmark_synthetic(specs, repeat=5):
+	"""Benchmark synthetic saves of the given sizes, giving JSON
+
+	Each spec is weapons[:items[:bank[:seed]]], with anything left off taking
+	synthetic_savefile's defaults. The saves go through the real encoder, then
+	get decoded and re-encoded a stage at a time, so the results can be
+	compared from one version to another.
+	"""
+	sizes = []
+	for spec in specs: # Check them all before spending time on any of them
+		try: sizes.append([int(n) for n in spec.split(":")])
+		except ValueError: sizes.append([])
+		if not 1 <= len(sizes[-1]) <= 4:
+			parser.error("Bad --benchmark-synthetic spec %r, should be weapons[:items[:bank[:seed]]]" % spec)
+	results = []
+	for spec, size in zip(specs, sizes):
+		weapons, items, bank, seed = size + list(synthetic_savefile.__defaults__[len(size):])
+		start = time.perf_counter()
+		data = encode_savefile(synthetic_savefile(weapons, items, bank, seed))
+		results.append({
+			"spec": spec, "weapons": weapons, "items": items, "bank": bank, "seed": seed,
+			"bytes": len(data), "generate": time.perf_counter() - start,
+			"stages": dict(benchmark_savefile(data, repeat)),
+		})
+	return json.dumps({"game": GAME, "python": sys.version.split()[0], "repeat": repeat, "results": results}, indent=2)
+
+def verify_chunked(size=3 * LZO_BLOCK_SIZE + 12345):
+	"""Check that a save bigger than one LZO block round-trips through the real lzo module
+
+	Real saves that big are hard to come by, so this makes one up (as per
+	--benchmark-synthetic and pad:N), writes it, and then reads and verifies
+	it the same way as --verify would a real one.
+	"""
+	savefile = synthetic_savefile(5, 5, 5)
+	pad(savefile, size)
+	data = encode_savefile(savefile)
+	with tempfile.NamedTemporaryFile(suffix=".sav") as f:
+		f.write(data); f.flush()
+		result = verify_savefile(f.name)
+		hash, reread = read_savefile(f.name)
+	raw = decompress_savefile(Consumable(data[20:]))
+	if len(raw) <= LZO_BLOCK_SIZE:
+		raise SaveFileFormatError("Only made a %d byte save, not big enough to need chunking" % len(raw))
+	if [slot.serial for slot in reread.bank] != [slot.serial for slot in savefile.bank]:
+		raise SaveFileFormatError("Bank came back different after chunked compression")
+	return "Chunked, %d bytes in %d blocks: %s" % (len(raw), int.from_bytes(data[24:28], "big"), result)
+
+
+def inventory(fn):
+	"""Get a save file's weapons and items (that pass the loot filters) for diff_inventories"""
+	hash, savefile = read_savefile(fn)
+	slots = (savefile.packed_weapon_data or []) + (savefile.packed_item_data or []) + (savefile.bank or [])
+	if args.loot_filter: pairs = filter_inventory(slots)
+	else: pairs = [(slot, it) for slot, it in zip(slots, Asset.decode_asset_libraries([slot.serial for slot in slots])) if it]
+	# The seed is random for each item, so together with its balance, it's as good as a unique ID
+	return [((it.seed, it.balance, it.type), it.grade, slot.prefix() + repr(it)) for slot, it in pairs]
+
+def savedata_dir():
+	"""Find the directory with every player's saves in it, as per --proton/--native"""
+	if args.platform == "native":
+		return os.path.expanduser("~/.local/share/aspyr-media/" + GAME + "/willowgame/savedata")
 	appid = "261640" if GAME == "borderlands the pre-sequel" else "49520"
-	dir = os.path.expanduser("~/.steam/steam/steamapps/compatdata/" + appid +
+	return os.path.expanduser("~/.steam/steam/steamapps/compatdata/" + appid +
 		"/pfx/drive_c/users/steamuser/My Documents/My Games/Borderlands 2/WillowGame/SaveData")
-if args.player == "list":
-	print("Player IDs available:")
-	for player in sorted(os.listdir(dir)):
-		print("--player", player)
-	sys.exit(0)
-if args.file:
-	try: os.stat(args.file)
+
+def player_dir(dir):
+	return args.dir or os.path.join(dir, args.player or os.listdir(dir)[0]) # If this bombs, you might not have any saves
+
+def serve():
+	"""Keep everything loaded, and answer requests from --client over a Unix socket
+
+	Each request is a command line, run as if it had been given to this script
+	(with the client's working directory), and the output is sent back. The
+	save directory is checked every so often, and anything new or changed is
+	decoded straight away, so it's all ready before anyone asks.
+	"""
+	dir = player_dir(savedata_dir())
+	server_args, listing = args, parser.parse_args(["-l"])
+	seen = { }
+	def warm():
+		global args
+		args = listing
+		for fn in sorted(os.listdir(dir)):
+			if not fn.endswith(".sav"): continue
+			st = os.stat(os.path.join(dir, fn))
+			if seen.get(fn) == (st.st_mtime, st.st_size): continue
+			seen[fn] = st.st_mtime, st.st_size
+			print("Loading", fn, end="... ", flush=True)
+			start = time.perf_counter()
+			try:
+				with contextlib.redirect_stdout(io.StringIO()): parse_savefile(os.path.join(dir, fn))
+			except SaveFileFormatError as e: print(e.args[0])
+			else: print("%.3fs" % (time.perf_counter() - start))
+		args = server_args
+	class Handler(socketserver.StreamRequestHandler):
+		def handle(self):
+			global args
+			try: request = json.loads(self.rfile.readline())
+			except ValueError: return
+			out = io.StringIO()
+			status, cwd = 0, os.getcwd()
+			with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+				# There's no terminal for anything interactive, so don't let it wait for one
+				stdin, sys.stdin = sys.stdin, io.StringIO()
+				try:
+					os.chdir(request["cwd"])
+					args = parser.parse_args(request["argv"])
+					if args.game != GAME: raise SystemExit("This server is for %s, not %s" % (GAME, args.game))
+					# --watch would never return, and nobody else would get a turn
+					if args.serve or args.client or args.watch: raise SystemExit("Can't do that from a client")
+					main()
+				except SystemExit as e:
+					if isinstance(e.code, str): print(e.code)
+					status = e.code if isinstance(e.code, int) else e.code is not None
+				except Exception:
+					traceback.print_exc()
+					status = 1
+				finally:
+					args, sys.stdin = server_args, stdin
+					os.chdir(cwd)
+			self.wfile.write(json.dumps({"status": status, "output": out.getvalue()}).encode("utf-8"))
+	os.makedirs(os.path.dirname(os.path.abspath(SERVE_SOCKET)), exist_ok=True)
+	try: os.unlink(SERVE_SOCKET) # Hopefully left over from a previous one
 	except FileNotFoundError: pass
+	with socketserver.UnixStreamServer(SERVE_SOCKET, Handler) as server:
+		server.timeout = SERVE_POLL
+		print("Listening on", SERVE_SOCKET)
+		try:
+			while "serving":
+				warm()
+				server.handle_request() # Returns after one request, or after the timeout
+		except KeyboardInterrupt: pass
+		finally: os.unlink(SERVE_SOCKET)
+
+def main():
+	if args.compare:
+		compare(*args.compare)
+		sys.exit()
+	if args.library and "{}" not in args.library:
+		# Doesn't need any save files, so don't bother scanning them
+		import_library(args.library)
+		sys.exit()
+	if args.benchmark_synthetic:
+		results = benchmark_synthetic(args.benchmark_synthetic)
+		if args.benchmark_output:
+			with open(args.benchmark_output, "w") as f: print(results, file=f)
+		else: print(results)
+		sys.exit()
+	if args.verify_chunked:
+		try: print(verify_chunked())
+		except SaveFileFormatError as e: sys.exit(e.args[0])
+		sys.exit()
+	if args.profile_startup:
+		profile_startup()
+		sys.exit()
+	if args.precompute_balances:
+		precompute_balances()
+		sys.exit()
+	dir = savedata_dir()
+	if args.player == "list":
+		print("Player IDs available:")
+		for player in sorted(os.listdir(dir)):
+			print("--player", player)
+		sys.exit(0)
+	if args.file:
+		try: os.stat(args.file)
+		except FileNotFoundError: pass
+		else:
+			ok = process_savefile(args.file)
+			sys.exit(0 if ok or not args.verify else 1)
+	if args.query is not None:
+		# Update the index from every player's saves, unless we've been told which to look at.
+		# Characters from the other game stay in the index from whenever it was last run for them.
+		if args.dir or args.player: dirs = [args.dir or os.path.join(dir, args.player)]
+		else:
+			try: dirs = [os.path.join(dir, player) for player in sorted(os.listdir(dir))]
+			except FileNotFoundError: dirs = []
+		for d in dirs: update_index(d)
+		run_query(args.query)
+		sys.exit(0)
+	dir = player_dir(dir)
+	if args.watch:
+		watch(dir, inventory)
+		sys.exit()
+	if args.benchmark_memory:
+		print(benchmark_memory(dir))
+		sys.exit()
+	file = (args.file or "").replace(".sav", "")
+	fns = [fn for fn in sorted(os.listdir(dir)) if fn.endswith(".sav") and fnmatch(fn, "*" + file + ".sav")]
+	failures = 0
+	# Synthesizers all write to the same output file, so they have to go one at a time.
+	if args.jobs > 1 and len(fns) > 1 and not args.synth:
+		# Compile/open the assets up front, rather than having every worker race to do it
+		for fn in ASSET_FILES:
+			if os.path.exists(asset_path(fn)): get_asset(fn)
+		with concurrent.futures.ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+			# map() yields in submission order, so the output stays sorted regardless of which finishes first
+			for fn, (output, tm, ok) in zip(fns, pool.map(scan_savefile, [os.path.join(dir, fn) for fn in fns])):
+				print("%s [%.3fs]... " % (fn, tm), end="")
+				print(output, end="")
+				failures += not ok
 	else:
-		try: print(parse_savefile(args.file))
+		for fn in fns:
+			print(fn, end="... ")
+			failures += not process_savefile(os.path.join(dir, fn))
+	prune_scans()
+	if args.verify:
+		# Verification replaces the listing, so there's nothing else worth doing after it.
+		# Nonzero exit if anything didn't round-trip, for the benefit of scripts.
+		if failures: print("%d of %d saves failed verification" % (failures, len(fns)))
+		sys.exit(1 if failures else 0)
+	if file == "synth":
+		try: print(parse_savefile("synthesized.sav"))
 		except SaveFileFormatError as e: print(e.args[0])
-		sys.exit(0)
-dir = args.dir or os.path.join(dir, args.player or os.listdir(dir)[0]) # If this bombs, you might not have any saves
-file = (args.file or "").replace(".sav", "")
-for fn in sorted(os.listdir(dir)):
-	if not fn.endswith(".sav"): continue
-	if not fnmatch(fn, "*" + file + ".sav"): continue
-	print(fn, end="... ")
-	try: print(parse_savefile(os.path.join(dir, fn)))
-	except SaveFileFormatError as e: print(e.args[0])
-if file == "synth":
-	try: print(parse_savefile("synthesized.sav"))
-	except SaveFileFormatError as e: print(e.args[0])
-if args.library:
-	if args.library == "input": lib = iter(input, "")
-	else: lib = args.library.split(",")
-	for id in lib:
-		if '{' in id: id = id.split("{")[1].split("}")[0]
-		if not id: continue
-		serial = base64.b64decode(id.encode("ascii") + b"====")
-		obj = Asset.decode_asset_library(serial)
-		obj.grade = obj.stage = obj.seed = 50
-		serial = obj.encode_asset_library()
-		id = base64.b64encode(serial).decode("ascii").strip("=")
-		if id not in library[args.game]:
-			print('\t\t"%s": "%s",' % (id, obj.get_title()))
+	if args.library:
+		# "{}" means everything that got listed (see Asset.__repr__)
+		import_library([id for id in args.library if id != "{}"])
+
+if args.profile:
+	atexit.register(report_caches)
+if args.serve: serve()
+else: main()